@@ -0,0 +1,70 @@
+import math
+import numpy as np
+
+# Fitness penalty of each overflowing machine day in the GA
+OVERFLOW_PENALTY = 50
+
+
+def day_capacity(data):
+    # Space left on each day over all the machines
+    return np.array([sum(max(space, 0) for space in bin_d.values()) for bin_d in data["bin_days"].values()], dtype=float)
+
+
+def arrival_load(data, arrivals=True):
+    # Total treatment time of the patients arriving on each day (all on day 0 without arrivals)
+    load = {}
+    for item_k in data["patients"].values():
+        a = item_k["arrival_day"] if arrivals else 0
+        load[a] = load.get(a, 0) + sum(item_k["fractions"].values())
+    return load
+
+
+def treatment_days(data, arrivals=True):
+    # Days of the longest treatment, started on its arrival day
+    return max((item_k["arrival_day"] if arrivals else 0) + len(item_k["fractions"]) for item_k in data["patients"].values())
+
+
+def makespan_bound(data, arrivals=True):
+    # Days needed by any schedule: the longest treatment from its arrival day, and the patients
+    # arriving from day a on need at least their total time on the days from a on (over all the
+    # machines). Without arrivals the patients can start on day 0, as in the GA
+    bound = treatment_days(data, arrivals)
+    capacity = day_capacity(data)
+    load = 0
+    for a, load_a in sorted(arrival_load(data, arrivals).items(), reverse=True):
+        load += load_a
+        enough = np.flatnonzero(np.cumsum(capacity[a:]) >= load)
+        bound = max(bound, a + int(enough[0]) + 1 if len(enough) > 0 else len(capacity))
+    return bound
+
+
+def days_bound(data):
+    # Objective of the exact models (sum of d + 1 over the used days d) of any schedule
+    # Each patient uses its fractions' consecutive days, the cheapest ones from its arrival day
+    bound = max(len(item_k["fractions"]) * item_k["arrival_day"] + len(item_k["fractions"]) * (len(item_k["fractions"]) + 1) // 2
+                for item_k in data["patients"].values())
+
+    # The used days have room for all the treatments: cheapest (fractional) cover of the total
+    # time with the days sorted by cost per minute of capacity
+    capacity = day_capacity(data)
+    load = sum(arrival_load(data).values())
+    cost = 0
+    for d in sorted(np.flatnonzero(capacity > 0), key=lambda d: (d + 1) / capacity[d]):
+        used = min(capacity[d], load)
+        cost += (d + 1) * used / capacity[d]
+        load -= used
+        if load <= 0:
+            return max(bound, math.ceil(cost - 1e-9))
+    return bound
+
+
+def fitness_bound(data):
+    # GA fitness (days up to the last used one, plus OVERFLOW_PENALTY per overflowing machine day)
+    # of any individual: the GA starts every treatment from day 0, and with an overflow the
+    # capacity bound no longer holds but the longest treatment still does
+    return min(makespan_bound(data, arrivals=False), treatment_days(data, arrivals=False) + OVERFLOW_PENALTY)
+
+
+def gap(objective, bound):
+    # Relative gap between an objective and a lower bound of it
+    return (objective - bound) / objective if objective > 0 else 0.0
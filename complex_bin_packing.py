@@ -1,149 +1,313 @@
-import argparse
-from ortools.linear_solver import pywraplp
-from data_manipulation import create_data_model
-import dill
-
-
-parser = argparse.ArgumentParser(description='Plot fitnesses of same encoding but different seeds.')
-
-parser.add_argument('-f', dest='arrivals_file', action='store',
-                    help='File of patient arrivals (must be in folder "data")', default='instances/2020_PatientArrivals_instance_1')
-parser.add_argument('-s', dest='save_file', action='store',
-                    help='File of patient arrivals (must be in folder "data")', default='ILP_instance_1')
-parser.add_argument('-b', dest='backend_solver', action='store',
-                    help='ILP solver (either SCIP or SAT)', default='SCIP')
-
-args = parser.parse_args()
-
-def main(args):
-    data = create_data_model(args)
-
-    #print(data)
-    # Create the mip solver with the SCIP backend.
-    solver = pywraplp.Solver.CreateSolver(args.backend_solver)
-    #solver.parameters.num_search_workers = 8
-
-    if not solver:
-        return
-
-    # Variables
-    # x[j,k,i,d] = 1 if item j of patient k is packed in bin i of day d.
-    x = {}
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in data["bin_days"].items():
-                for i in bin_d:
-                    x[(j, k, i, d)] = solver.IntVar(0, 1, f"x_{j}_{k}_{i}_{d}")
-
-    # y[i, d] = 1 if bin i is used in day d.
-    y = {}
-    for d, bin_d in data["bin_days"].items():
-        for i in bin_d:
-            y[(i, d)] = solver.IntVar(0, 1, f"y_{i}_{d}")
-
-    # z[d] = 1 if a bin of day d is used
-    z = {}
-    for d, bin_d in data["bin_days"].items():
-        z[d] = solver.IntVar(0, 1, f"z_{d}")
-
-    # Constraints
-    # Each item of each patient must be in exactly one bin in one day.
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            solver.Add(sum(x[j, k, i, d] for i in bin_d for d, bin_d in data["bin_days"].items()) == 1)
-
-    # Z[d] is 1 if a bin of day d is used (z[d] = min(1, sum(y[i, d] for i in bin_d)) linearized)
-    for d, bin_d in data["bin_days"].items():
-        solver.Add(sum(y[i, d] for i in bin_d) <= len(bin_d) * z[d])
-        solver.Add(1 - sum(y[i, d] for i in bin_d) <= len(bin_d) * (1 - z[d]))
-
-    # The amount packed in each bin cannot exceed its capacity.
-    for d, bin_d in data["bin_days"].items():
-        for i in bin_d:
-            solver.Add(
-                sum(x[(j, k, i, d)] * data["patients"][k]["fractions"][j]
-                    for k, item_k in data["patients"].items()
-                    for j in item_k["fractions"]
-                    ) <= y[(i,d)] * data["bin_days"][d][i]
-            )
-            #print(f"Aggiunto vincolo per : day={d}, machine={i}, day_actual={day_actual}")
-
-    # Items must be packed consecutively day by day: item j before item j+1
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in data["bin_days"].items():
-                if ((j + 1, k, i, d + 1) in x):
-                    solver.Add(
-                        sum(x[(j, k, i, d)] for i in bin_d) ==
-                        sum(x[(j + 1, k, i, d + 1)] for i in bin_d)
-                    )
-
-    # Each fraction j of patient k must be packed in the allowed bins for each day d
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in data["bin_days"].items():
-                solver.Add(
-                    sum(x[(j, k, i, d)] for i in bin_d if i not in item_k["machines"]) == 0
-                )
-
-    # Each patient cannot be scheduled on a day before their arrival
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in {d: bin_d for d, bin_d in data["bin_days"].items() if d <item_k["arrival_day"]}.items():
-                solver.Add(
-                    sum(x[(j, k, i, d)] for i in bin_d) == 0
-                )
-
-    # Objective: minimize the number of days used
-    solver.Minimize(solver.Sum([z[d] * (d+1) for d, bin_d in data["bin_days"].items()]))
-    print(f"Solving with {solver.SolverVersion()}")
-    status = solver.Solve()
-
-    with open(f"{args.save_file}.txt", "w") as outfile:
-        save_dict = {}
-        if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
-            num_days = 0
-            delays = {}
-            for d, bin_d in data["bin_days"].items():
-                num_bins = 0
-                for i in bin_d:
-                    if y[(i, d)].solution_value() == 1:
-                        if str(data["day_to_actual_days"][d]) not in save_dict:
-                            save_dict[str(data["day_to_actual_days"][d])] = {}
-                        save_dict[str(data["day_to_actual_days"][d])][i] = []
-                        bin_items = []
-                        bin_weight = 540-data["bin_days"][d][i]
-                        for k, item_k in data["patients"].items():
-                            for j in item_k["fractions"]:
-                                if x[j, k, i, d].solution_value() > 0:
-                                    bin_items.append((j, k))
-                                    save_dict[str(data["day_to_actual_days"][d])][i].append({'patient': k, 'fraction': j})
-                                    bin_weight += item_k["fractions"][j]
-                                    if j == 1:
-                                        delays[k] = d - item_k["arrival_day"]
-                        if bin_items:
-                            num_bins += 1
-                            outfile.write(f"Bin number {i}, day {data["day_to_actual_days"][d]}")
-                            outfile.write(f"\n  Items packed: {bin_items}")
-                            outfile.write(f"\n  Total weight: {bin_weight}\n")
-                if num_bins > 0:
-                    num_days = d+1
-            outfile.write(f"\nNumber of days used: {num_days}")
-            save_dict['num_days'] = num_days
-            save_dict['solver_time'] = solver.WallTime()
-            status_str = "feasible" if status == pywraplp.Solver.FEASIBLE else "optimal"
-            outfile.write(f"\nSolution found: {status_str}")
-            outfile.write(f"\nTime = {solver.WallTime()} milliseconds")
-            outfile.write(f"\n\nDelays: {dict(sorted(delays.items()))}")
-        else:
-            outfile.write("The problem does not have an optimal solution.")
-
-    with open(f"{args.save_file}.pkl", "wb") as handle:
-        dill.dump(save_dict, handle, protocol=dill.HIGHEST_PROTOCOL)
-
-
-if __name__ == "__main__":
-    main(args)
-    with open(f"{args.save_file}.pkl", "rb") as f:
-        ilp_data = dill.load(f)
+import argparse
+import functools
+import time
+from ortools.linear_solver import pywraplp
+from ortools.linear_solver.python import model_builder
+from ortools.linear_solver import linear_solver_pb2
+import numpy as np
+import scipy.sparse
+from data_manipulation import create_data_model, load_ga_schedule
+import dill
+import exact_model
+import solver_config
+import incumbents
+import model_cache
+import horizon
+import bounds
+import decomposition
+
+
+parser = argparse.ArgumentParser(description='Plot fitnesses of same encoding but different seeds.')
+
+parser.add_argument('-f', dest='arrivals_file', action='store',
+                    help='File of patient arrivals (must be in folder "data")', default='instances/2020_PatientArrivals_instance_1')
+parser.add_argument('-s', dest='save_file', action='store',
+                    help='File of patient arrivals (must be in folder "data")', default='ILP_instance_1')
+parser.add_argument('--formulation', dest='formulation', action='store',
+                    help='Model formulation: one variable per fraction, machine and day (fractions) or start-day variables (start, larger model, not the default)', default='fractions', choices=['fractions', 'start'])
+parser.add_argument('--builder', dest='builder', action='store',
+                    help='Model construction: one linear expression per constraint (expressions) or a sparse constraint matrix loaded in bulk (matrix)', default='expressions', choices=['expressions', 'matrix'])
+parser.add_argument('-b', dest='backend_solver', action='store',
+                    help='ILP solver (either SCIP or SAT)', default='SCIP')
+
+parser.add_argument('--hint', dest='hint_file', action='store',
+                    help='GA result (pickle saved by the ga_patient_scheduling scripts) used as starting solution', default=None)
+parser.add_argument('--window', dest='window', action='store',
+                    help='Rolling horizon: number of arrival days whose patients are committed at each step (whole instance at once if not given)', default=None, type=int)
+parser.add_argument('--overlap', dest='overlap', action='store',
+                    help='Rolling horizon: arrival days after each window whose patients are scheduled with it but not committed', default=0, type=int)
+model_cache.add_arguments(parser)
+horizon.add_arguments(parser)
+decomposition.add_arguments(parser)
+solver_config.add_arguments(parser)
+incumbents.add_arguments(parser, 'seconds')
+
+args = parser.parse_args()
+if args.window is not None and (args.target is not None or args.bound):
+    # Both refer to the objective of the whole instance, not to the one of a window
+    parser.error("--target and --bound cannot be used with --window")
+if args.stall is not None:
+    # pywraplp has no solution callback: the time since the last improvement is never known
+    parser.error("--stall is only available with complex_bin_packing_cp.py")
+
+def build_matrix_model(solver, data, formulation):
+    # Same models as build_model and build_start_model, with the variables enumerated as arrays and
+    # the constraint matrix assembled as a sparse matrix, loaded into the solver in one call through
+    # model_builder: no linear expression is built in Python, the work is linear in the non-zeros
+    horizon = len(data["bin_days"])
+    bins = [(i, d) for d, bin_d in data["bin_days"].items() for i in bin_d]
+    # Row of bin (i, d) in the capacity constraints, looked up by day and machine number
+    machine_index = {i: m for m, i in enumerate(sorted({i for i, d in bins}))}
+    bin_index = np.full((horizon, len(machine_index)), -1, dtype=int)
+    for b, (i, d) in enumerate(bins):
+        bin_index[d, machine_index[i]] = b
+    num_vars = 0
+    num_rows = 0
+    rows, cols, coefs = [], [], []
+    row_lb, row_ub = [], []
+
+    def add_vars(count):
+        nonlocal num_vars
+        num_vars += count
+        return np.arange(num_vars - count, num_vars)
+
+    def add_rows(count, lb, ub):
+        nonlocal num_rows
+        num_rows += count
+        row_lb.append(np.full(count, lb, dtype=float))
+        row_ub.append(np.full(count, ub, dtype=float))
+        return np.arange(num_rows - count, num_rows)
+
+    def add_terms(row, col, coef):
+        row, col, coef = np.broadcast_arrays(row, col, coef)
+        rows.append(row.ravel())
+        cols.append(col.ravel())
+        coefs.append(coef.ravel().astype(float))
+
+    # y[i, d] = 1 if bin i is used in day d, z[d] = 1 if a bin of day d is used
+    y_vars = add_vars(len(bins))
+    z_vars = add_vars(horizon)
+
+    # x[j,k,i,d] (and s[k,d] in the start formulation): for each patient the fraction j (0-based jj)
+    # can be packed on the days arrival_day + jj + t, for the same t in [0, days) for every fraction
+    capacity_rows = add_rows(len(bins), -np.inf, 0)
+    x_keys = []
+    x_cols = []
+    for k, item_k in data["patients"].items():
+        fractions = list(item_k["fractions"].keys())
+        sizes = np.array(list(item_k["fractions"].values()), dtype=float)
+        machines = item_k["machines"]
+        n, m = len(fractions), len(machines)
+        days = max(horizon - n - item_k["arrival_day"] + 1, 0)
+        jj, t, mm = [a.ravel() for a in np.meshgrid(np.arange(n), np.arange(days), np.arange(m), indexing="ij")]
+        day = item_k["arrival_day"] + jj + t
+
+        if formulation == 'start':
+            # s[k, arrival_day + t] = 1 if patient k starts on that day, exactly once
+            s_vars = add_vars(days)
+            add_terms(add_rows(1, 1, 1), s_vars, 1)
+            if m == 1:
+                var = s_vars[t]
+            else:
+                var = add_vars(len(jj))
+                # Fraction jj is packed on day arrival_day + jj + t iff k starts on day arrival_day + t
+                link_rows = add_rows(n * days, 0, 0)
+                add_terms(link_rows[jj * days + t], var, 1)
+                add_terms(link_rows[np.arange(n * days)], s_vars[np.tile(np.arange(days), n)], -1)
+        else:
+            var = add_vars(len(jj))
+            # Each item must be in exactly one bin in one day
+            assign_rows = add_rows(n, 1, 1)
+            add_terms(assign_rows[jj], var, 1)
+            # Items packed consecutively day by day: item jj on day d iff item jj + 1 on day d + 1
+            if n > 1:
+                consecutive_rows = add_rows((n - 1) * days, 0, 0)
+                before = jj < n - 1
+                add_terms(consecutive_rows[jj[before] * days + t[before]], var[before], 1)
+                after = jj > 0
+                add_terms(consecutive_rows[(jj[after] - 1) * days + t[after]], var[after], -1)
+
+        # Capacity: fraction sizes packed in the bin
+        machine_ids = np.array([machine_index[i] for i in machines], dtype=int)
+        add_terms(capacity_rows[bin_index[day, machine_ids[mm]]], var, sizes[jj])
+        x_keys.extend(zip((fractions[j] for j in jj), [k] * len(jj), (machines[i] for i in mm), day.tolist()))
+        x_cols.append(var)
+
+    # The amount packed in each bin cannot exceed its capacity
+    add_terms(capacity_rows, y_vars, [-data["bin_days"][d][i] for i, d in bins])
+
+    # Z[d] is 1 if a bin of day d is used (z[d] = min(1, sum(y[i, d] for i in bin_d)) linearized)
+    bin_days = np.array([d for i, d in bins])
+    bins_per_day = np.array([len(data["bin_days"][d]) for d in range(horizon)])
+    upper_rows = add_rows(horizon, -np.inf, 0)
+    add_terms(upper_rows[bin_days], y_vars, 1)
+    add_terms(upper_rows, z_vars, -bins_per_day)
+    lower_rows = add_rows(horizon, -np.inf, bins_per_day - 1)
+    add_terms(lower_rows[bin_days], y_vars, -1)
+    add_terms(lower_rows, z_vars, bins_per_day)
+
+    # Objective: minimize the number of days used
+    objective = np.zeros(num_vars)
+    objective[z_vars] = np.arange(horizon) + 1
+
+    matrix = scipy.sparse.csr_matrix((np.concatenate(coefs), (np.concatenate(rows), np.concatenate(cols))), shape=(num_rows, num_vars))
+    model = model_builder.Model()
+    model.helper.fill_model_from_sparse_data(np.zeros(num_vars), np.ones(num_vars), objective,
+                                             np.concatenate(row_lb), np.concatenate(row_ub), matrix)
+    for var in range(num_vars):
+        model.helper.set_var_integrality(var, True)
+    solver.LoadModelFromProto(model.export_to_proto())
+
+    variables = solver.variables()
+    x_vars = np.concatenate(x_cols) if x_cols else np.array([], dtype=int)
+    x = {key: variables[var] for key, var in zip(x_keys, x_vars)}
+    y = {bin_id: variables[var] for bin_id, var in zip(bins, y_vars)}
+    z = {d: variables[var] for d, var in zip(range(horizon), z_vars)}
+    return x, y, z
+
+
+def save_solution(save_file, data, bin_items, used_bins, status_str, wall_time):
+    with open(f"{save_file}.txt", "w") as outfile:
+        save_dict = {}
+        if status_str is not None:
+            num_days = 0
+            delays = {}
+            for d, bin_d in data["bin_days"].items():
+                num_bins = 0
+                for i in bin_d:
+                    if (i, d) in used_bins:
+                        if str(data["day_to_actual_days"][d]) not in save_dict:
+                            save_dict[str(data["day_to_actual_days"][d])] = {}
+                        save_dict[str(data["day_to_actual_days"][d])][i] = []
+                        bin_weight = 540-data["bin_days"][d][i]
+                        for j, k in bin_items.get((i, d), []):
+                            save_dict[str(data["day_to_actual_days"][d])][i].append({'patient': k, 'fraction': j})
+                            bin_weight += data["patients"][k]["fractions"][j]
+                            if j == 1:
+                                delays[k] = d - data["patients"][k]["arrival_day"]
+                        if (i, d) in bin_items:
+                            num_bins += 1
+                            outfile.write(f"Bin number {i}, day {data["day_to_actual_days"][d]}")
+                            outfile.write(f"\n  Items packed: {bin_items[(i, d)]}")
+                            outfile.write(f"\n  Total weight: {bin_weight}\n")
+                if num_bins > 0:
+                    num_days = d+1
+            outfile.write(f"\nNumber of days used: {num_days}")
+            save_dict['num_days'] = num_days
+            save_dict['solver_time'] = wall_time
+            outfile.write(f"\nSolution found: {status_str}")
+            outfile.write(f"\nTime = {wall_time} milliseconds")
+            outfile.write(f"\n\nDelays: {dict(sorted(delays.items()))}")
+        else:
+            outfile.write("The problem does not have an optimal solution.")
+
+    with open(f"{save_file}.pkl", "wb") as handle:
+        dill.dump(save_dict, handle, protocol=dill.HIGHEST_PROTOCOL)
+
+
+def solve(data, args, used_days=(), hint_file=None, run_incumbents=None):
+    # Build and solve the model of data, the days in used_days are already used (and paid for).
+    # run_incumbents (incumbents.Incumbents) gives the time budget, the early stop rules and the
+    # lower bound of the objective
+    # Create the mip solver with the SCIP backend.
+    solver = pywraplp.Solver.CreateSolver(args.backend_solver)
+
+    if not solver:
+        return None, {}, set(), 0
+
+    build_start = time.time()
+    # The model does not depend on the backend, nor on the builder
+    cache_file = model_cache.get_cache_file(args.model_cache, data, 'ilp', args.formulation) if args.model_cache is not None else None
+    loaded = cache_file is not None and cache_file.exists()
+    if loaded:
+        def load_proto(serialized):
+            proto = linear_solver_pb2.MPModelProto()
+            proto.ParseFromString(serialized)
+            solver.LoadModelFromProto(proto)
+            return solver.variables()
+        x, y, z = model_cache.load(cache_file, load_proto)
+    elif args.builder == 'matrix':
+        x, y, z = build_matrix_model(solver, data, args.formulation)
+    elif args.formulation == 'start':
+        x, y, z = exact_model.build_start_model(solver, data, lambda name: solver.IntVar(0, 1, name))
+    else:
+        x, y, z = exact_model.build_model(solver, data, lambda name: solver.IntVar(0, 1, name))
+    build_time = time.time() - build_start
+    if cache_file is not None and not loaded:
+        # Saved before the used days, the hint and the cutoff, which depend on the run
+        proto = linear_solver_pb2.MPModelProto()
+        solver.ExportModelToProto(proto)
+        model_cache.save(cache_file, proto, x, y, z, lambda var: var.index())
+    for d in used_days:
+        if d in z:
+            z[d].SetBounds(1, 1)
+    if hint_file is not None:
+        items, feasible = load_ga_schedule(hint_file, data)
+        hint, objective = exact_model.get_hint(items, x, y, z)
+        solver.SetHint([var for var, value in hint], [value for var, value in hint])
+        print(f"Hint: GA schedule with objective {objective} ({'feasible' if feasible else 'infeasible'})")
+        if feasible and not used_days:
+            # Objective cutoff: only solutions at least as good as the GA one (not in a rolling
+            # horizon window after the first, whose objective also counts the days already used)
+            solver.Add(sum(z[d] * (d+1) for d in z) <= objective)
+    if run_incumbents is not None and run_incumbents.lower_bound is not None:
+        # Lower bound of the objective (bounds.days_bound): the search is over as soon as a
+        # solution reaches it, instead of proving its optimality
+        solver.Add(sum(z[d] * (d+1) for d in z) >= run_incumbents.lower_bound)
+    # Workers, time limit, gap, presolve, LNS and parameter file from the command line
+    # pywraplp has no solution callback: the budget becomes a time limit and SCIP stops by
+    # itself at the target (--stall is rejected)
+    time_budget = run_incumbents.remaining() if run_incumbents is not None else None
+    specific_params = []
+    if run_incumbents is not None and run_incumbents.target is not None and args.backend_solver == 'SCIP':
+        specific_params.append(f"limits/objectivestop = {run_incumbents.target}")
+    params = solver_config.configure_ilp(solver, args, time_budget, specific_params)
+    print(f"Solving with {solver.SolverVersion()}")
+    solve_start = time.time()
+    status = solver.Solve(params)
+    print(f"Model {'loaded' if loaded else 'built'} in {build_time:.3f} s ({solver.NumVariables()} variables, {solver.NumConstraints()} constraints), solved in {time.time() - solve_start:.3f} s")
+
+    if status == pywraplp.Solver.OPTIMAL or status == pywraplp.Solver.FEASIBLE:
+        bin_items = exact_model.get_bin_items(x, lambda var: var.solution_value())
+        used_bins = {bin_id for bin_id, y_var in y.items() if y_var.solution_value() == 1}
+        status_str = "feasible" if status == pywraplp.Solver.FEASIBLE else "optimal"
+        return status_str, bin_items, used_bins, solver.WallTime()
+    return None, {}, set(), solver.WallTime()
+
+
+def main(args):
+    data = create_data_model(args)
+    # Bound of the whole instance, computed before the horizon is trimmed: with --tight-horizon the
+    # solvers only prove optimality within the trimmed days
+    instance_bound = bounds.days_bound(data) if args.bound or args.tight_horizon else None
+    if args.tight_horizon:
+        data = horizon.tighten(data)
+
+    #print(data)
+    lower_bound = instance_bound if args.bound else None
+    run_incumbents = incumbents.Incumbents(args.incumbent_log, args.time_budget, args.target, args.stall, args.backend_solver, lower_bound)
+    if args.decompose:
+        status_str, bin_items, used_bins, wall_time = decomposition.solve(data, functools.partial(exact_model.solve_component, args=args, solve=solve, engine=args.backend_solver), args.decompose_workers)
+    else:
+        status_str, bin_items, used_bins, wall_time = exact_model.solve_instance(data, args, run_incumbents, solve)
+    if status_str is not None:
+        # Final solution (already in the log if it was streamed by the solver)
+        items = [(j, k, i, d) for (i, d), items_bin in bin_items.items() for j, k in items_bin]
+        objective = sum(d + 1 for d in {d for (i, d) in bin_items})
+        run_incumbents.update(run_incumbents.elapsed(), objective, lambda: incumbents.schedule_from_items(data, items))
+        if lower_bound is not None:
+            print(f"Objective {objective}, lower bound {lower_bound}, gap {bounds.gap(objective, lower_bound):.2%}")
+            if objective <= lower_bound:
+                # Also for the schedules merged from windows or components
+                status_str = "optimal"
+        if args.tight_horizon and status_str == "optimal" and objective > instance_bound:
+            # Optimal for the trimmed horizon, not proven for the whole instance
+            status_str = "feasible"
+    save_solution(args.save_file, data, bin_items, used_bins, status_str, wall_time)
+
+
+if __name__ == "__main__":
+    main(args)
+    with open(f"{args.save_file}.pkl", "rb") as f:
+        ilp_data = dill.load(f)
         print(ilp_data)
\ No newline at end of file
@@ -1,168 +1,224 @@
-import argparse
-from ortools.linear_solver import pywraplp
-from ortools.sat.python import cp_model
-from data_manipulation import create_data_model
-import dill
-from ortools.sat.sat_parameters_pb2 import SatParameters
-
-parser = argparse.ArgumentParser(description='Plot fitnesses of same encoding but different seeds.')
-
-parser.add_argument('-f', dest='arrivals_file', action='store',
-                    help='File of patient arrivals (must be in folder "data")', default='instances/2020_PatientArrivals_instance_1')
-parser.add_argument('-s', dest='save_file', action='store',
-                    help='File of patient arrivals (must be in folder "data")', default='ILP_instance_1')
-
-args = parser.parse_args()
-
-def main(args):
-    data = create_data_model(args, forceint=True)
-
-    # print(data["bin_days"])
-    # exit(1)
-    # Create the CP solver.
-    model = cp_model.CpModel()
-    solver = cp_model.CpSolver()
-    #solver.parameters.num_search_workers = 8
-
-    if not solver or not model:
-        return
-
-    # Variables
-    # x[j,k,i,d] = 1 if item j of patient k is packed in bin i of day d.
-    x = {}
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in data["bin_days"].items():
-                for i in bin_d:
-                    x[(j, k, i, d)] = model.NewIntVar(0, 1, f"x_{j}_{k}_{i}_{d}")
-
-    # y[i, d] = 1 if bin i is used in day d.
-    y = {}
-    for d, bin_d in data["bin_days"].items():
-        for i in bin_d:
-            y[(i, d)] = model.NewIntVar(0, 1, f"y_{i}_{d}")
-
-    # z[d] = 1 if a bin of day d is used
-    z = {}
-    for d, bin_d in data["bin_days"].items():
-        z[d] = model.NewIntVar(0, 1, f"z_{d}")
-
-    # Constraints
-    # Each item of each patient must be in exactly one bin in one day.
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            model.Add(sum(x[j, k, i, d] for i in bin_d for d, bin_d in data["bin_days"].items()) == 1)
-
-    # Z[d] is 1 if a bin of day d is used (z[d] = min(1, sum(y[i, d] for i in bin_d)) linearized)
-    for d, bin_d in data["bin_days"].items():
-        model.Add(sum(y[i, d] for i in bin_d) <= len(bin_d) * z[d])
-        model.Add(1 - sum(y[i, d] for i in bin_d) <= len(bin_d) * (1 - z[d]))
-
-    # The amount packed in each bin cannot exceed its capacity.
-    for d, bin_d in data["bin_days"].items():
-        for i in bin_d:
-            t = {}
-            for k, item_k in data["patients"].items():
-                for j in item_k["fractions"]:
-                    t[(k,j)] = model.NewIntVar(0, 1000000, f"t1_{k}_{j}")
-                    model.AddMultiplicationEquality(t[(k,j)], [x[(j, k, i, d)], data["patients"][k]["fractions"][j] ])
-            # v = model.NewIntVar(0, 10000000, f"t2_{i}_{d}")
-            # model.AddMultiplicationEquality(v, [y[(i,d)]], [data["bin_days"][d][i]])
-            model.Add(sum(t[(k,j)] for k, item_k in data["patients"].items()
-                                    for j in item_k["fractions"]) <=  data["bin_days"][d][i] * y[(i,d)])
-            #print(f"Aggiunto vincolo per : day={d}, machine={i}, day_actual={day_actual}")
-
-    # Items must be packed consecutively day by day: item j before item j+1
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in data["bin_days"].items():
-                if ((j + 1, k, i, d + 1) in x):
-                    model.Add(
-                        sum(x[(j, k, i, d)] for i in bin_d) ==
-                        sum(x[(j + 1, k, i, d + 1)] for i in bin_d)
-                    )
-
-    # Each fraction j of patient k must be packed in the allowed bins for each day d
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in data["bin_days"].items():
-                model.Add(
-                    sum(x[(j, k, i, d)] for i in bin_d if i not in item_k["machines"]) == 0
-                )
-
-    # Each patient cannot be scheduled on a day before their arrival
-    for k, item_k in data["patients"].items():
-        for j in item_k["fractions"]:
-            for d, bin_d in {d: bin_d for d, bin_d in data["bin_days"].items() if d <item_k["arrival_day"]}.items():
-                model.Add(sum(x[(j, k, i, d)] for i in bin_d) == 0)
-
-    # Objective: minimize the number of days used
-    # objective = model.NewIntVar(0, 100000, "objective")
-    # model.Add(sum(z[d] * (d+1) for d, bin_d in data["bin_days"].items()) == objective)
-    # model.minimize(objective)
-    model.Minimize(sum(z[d] * (d+1) for d, bin_d in data["bin_days"].items()))
-    print(f"Solving with CP-SAT solver")
-
-    solver.parameters.max_time_in_seconds = 3600
-    solver.parameters.num_search_workers = 8
-    # solver.parameters.log_search_progress = True
-    solver.parameters.cp_model_presolve = True
-    solver.parameters.enumerate_all_solutions = False
-    # print(dir(solver.parameters))
-    solver.parameters.binary_minimization_algorithm = SatParameters.BINARY_MINIMIZATION_FIRST_WITH_TRANSITIVE_REDUCTION
-    solver.parameters.search_branching = cp_model.PORTFOLIO_SEARCH
-    solver.parameters.use_lns = True
-
-    status = solver.Solve(model)
-
-    print(f"Status: {solver.StatusName(status)}")
-
-    with open(f"{args.save_file}.txt", "w") as outfile:
-        save_dict = {}
-        if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-            num_days = 0
-            delays = {}
-            for d, bin_d in data["bin_days"].items():
-                num_bins = 0
-                for i in bin_d:
-                    if solver.value(y[(i, d)]) == 1:
-                        if str(data["day_to_actual_days"][d]) not in save_dict:
-                            save_dict[str(data["day_to_actual_days"][d])] = {}
-                        save_dict[str(data["day_to_actual_days"][d])][i] = []
-                        bin_items = []
-                        bin_weight = 540-data["bin_days"][d][i]
-                        for k, item_k in data["patients"].items():
-                            for j in item_k["fractions"]:
-                                if solver.value(x[j, k, i, d]) > 0:
-                                    bin_items.append((j, k))
-                                    save_dict[str(data["day_to_actual_days"][d])][i].append({'patient': k, 'fraction': j})
-                                    bin_weight += item_k["fractions"][j]
-                                    if j == 1:
-                                        delays[k] = d - item_k["arrival_day"]
-                        if bin_items:
-                            num_bins += 1
-                            ttt = data["day_to_actual_days"][d]
-                            outfile.write(f"Bin number {i}, day {ttt}")
-                            outfile.write(f"\n  Items packed: {bin_items}")
-                            outfile.write(f"\n  Total weight: {bin_weight}\n")
-                if num_bins > 0:
-                    num_days = d+1
-            outfile.write(f"\nNumber of days used: {num_days}")
-            save_dict['num_days'] = num_days
-            save_dict['solver_time'] = solver.WallTime()
-            status_str = "feasible" if status == cp_model.FEASIBLE else "optimal"
-            outfile.write(f"\nSolution found: {status_str}")
-            outfile.write(f"\nTime = {solver.WallTime()} milliseconds")
-            outfile.write(f"\n\nDelays: {dict(sorted(delays.items()))}")
-        else:
-            outfile.write("The problem does not have an optimal solution.")
-
-    with open(f"{args.save_file}.pkl", "wb") as handle:
-        dill.dump(save_dict, handle, protocol=dill.HIGHEST_PROTOCOL)
-
-
-if __name__ == "__main__":
-    main(args)
-    with open(f"{args.save_file}.pkl", "rb") as f:
-        ilp_data = dill.load(f)
+import argparse
+import functools
+import time
+from ortools.linear_solver import pywraplp
+from ortools.sat.python import cp_model
+from data_manipulation import create_data_model, load_ga_schedule
+import dill
+import exact_model
+import solver_config
+import incumbents
+import model_cache
+import horizon
+import bounds
+import decomposition
+from ortools.sat.sat_parameters_pb2 import SatParameters
+
+parser = argparse.ArgumentParser(description='Plot fitnesses of same encoding but different seeds.')
+
+parser.add_argument('-f', dest='arrivals_file', action='store',
+                    help='File of patient arrivals (must be in folder "data")', default='instances/2020_PatientArrivals_instance_1')
+parser.add_argument('-s', dest='save_file', action='store',
+                    help='File of patient arrivals (must be in folder "data")', default='ILP_instance_1')
+parser.add_argument('--formulation', dest='formulation', action='store',
+                    help='Model formulation: one variable per fraction, machine and day (fractions) or start-day variables (start, larger model, not the default)', default='fractions', choices=['fractions', 'start'])
+
+parser.add_argument('--model-stats', dest='model_stats', action='store_true',
+                    help='Print the number of variables and constraints of the model before and after presolve')
+
+parser.add_argument('--hint', dest='hint_file', action='store',
+                    help='GA result (pickle saved by the ga_patient_scheduling scripts) used as starting solution', default=None)
+parser.add_argument('--window', dest='window', action='store',
+                    help='Rolling horizon: number of arrival days whose patients are committed at each step (whole instance at once if not given)', default=None, type=int)
+parser.add_argument('--overlap', dest='overlap', action='store',
+                    help='Rolling horizon: arrival days after each window whose patients are scheduled with it but not committed', default=0, type=int)
+model_cache.add_arguments(parser)
+horizon.add_arguments(parser)
+decomposition.add_arguments(parser)
+solver_config.add_arguments(parser, time_limit=3600)
+incumbents.add_arguments(parser, 'seconds')
+
+args = parser.parse_args()
+if args.window is not None and (args.target is not None or args.bound):
+    # Both refer to the objective of the whole instance, not to the one of a window
+    parser.error("--target and --bound cannot be used with --window")
+
+def presolved_model_size(log_lines):
+    # Number of variables and constraints of the presolved model, read from the
+    # "Presolved optimization model" summary of the CP-SAT search log
+    variables, constraints = 0, 0
+    lines = iter("\n".join(log_lines).splitlines())
+    for line in lines:
+        if line.startswith("Presolved optimization model"):
+            break
+    for line in lines:
+        if not line.strip():
+            break
+        if line.startswith("#Variables:"):
+            variables = int(line.split()[1])
+        elif line.startswith("#k"):
+            constraints += int(line.split()[1])
+    return variables, constraints
+
+
+def save_solution(save_file, data, bin_items, used_bins, status_str, wall_time):
+    with open(f"{save_file}.txt", "w") as outfile:
+        save_dict = {}
+        if status_str is not None:
+            num_days = 0
+            delays = {}
+            for d, bin_d in data["bin_days"].items():
+                num_bins = 0
+                for i in bin_d:
+                    if (i, d) in used_bins:
+                        if str(data["day_to_actual_days"][d]) not in save_dict:
+                            save_dict[str(data["day_to_actual_days"][d])] = {}
+                        save_dict[str(data["day_to_actual_days"][d])][i] = []
+                        bin_weight = 540-data["bin_days"][d][i]
+                        for j, k in bin_items.get((i, d), []):
+                            save_dict[str(data["day_to_actual_days"][d])][i].append({'patient': k, 'fraction': j})
+                            bin_weight += data["patients"][k]["fractions"][j]
+                            if j == 1:
+                                delays[k] = d - data["patients"][k]["arrival_day"]
+                        if (i, d) in bin_items:
+                            num_bins += 1
+                            ttt = data["day_to_actual_days"][d]
+                            outfile.write(f"Bin number {i}, day {ttt}")
+                            outfile.write(f"\n  Items packed: {bin_items[(i, d)]}")
+                            outfile.write(f"\n  Total weight: {bin_weight}\n")
+                if num_bins > 0:
+                    num_days = d+1
+            outfile.write(f"\nNumber of days used: {num_days}")
+            save_dict['num_days'] = num_days
+            save_dict['solver_time'] = wall_time
+            outfile.write(f"\nSolution found: {status_str}")
+            outfile.write(f"\nTime = {wall_time} milliseconds")
+            outfile.write(f"\n\nDelays: {dict(sorted(delays.items()))}")
+        else:
+            outfile.write("The problem does not have an optimal solution.")
+
+    with open(f"{save_file}.pkl", "wb") as handle:
+        dill.dump(save_dict, handle, protocol=dill.HIGHEST_PROTOCOL)
+
+
+def solve(data, args, used_days=(), hint_file=None, run_incumbents=None):
+    # Build and solve the model of data, the days in used_days are already used (and paid for).
+    # run_incumbents (incumbents.Incumbents) gives the time budget, the early stop rules and the
+    # lower bound of the objective
+    # Create the CP solver.
+    model = cp_model.CpModel()
+    solver = cp_model.CpSolver()
+
+    build_start = time.time()
+    cache_file = model_cache.get_cache_file(args.model_cache, data, 'cp', args.formulation) if args.model_cache is not None else None
+    loaded = cache_file is not None and cache_file.exists()
+    if loaded:
+        def load_proto(serialized):
+            model.Proto().ParseFromString(serialized)
+            return [model.GetIntVarFromProtoIndex(index) for index in range(len(model.Proto().variables))]
+        x, y, z = model_cache.load(cache_file, load_proto)
+    elif args.formulation == 'start':
+        x, y, z = exact_model.build_start_model(model, data, lambda name: model.NewIntVar(0, 1, name))
+    else:
+        x, y, z = exact_model.build_model(model, data, lambda name: model.NewIntVar(0, 1, name))
+    print(f"Model {'loaded' if loaded else 'built'} in {time.time() - build_start:.3f} s")
+    if cache_file is not None and not loaded:
+        # Saved before the used days, the hint and the cutoff, which depend on the run
+        model_cache.save(cache_file, model.Proto(), x, y, z, lambda var: var.Index())
+    for d in used_days:
+        if d in z:
+            model.Add(z[d] == 1)
+    if hint_file is not None:
+        items, feasible = load_ga_schedule(hint_file, data)
+        hint, objective = exact_model.get_hint(items, x, y, z)
+        for var, value in hint:
+            model.AddHint(var, value)
+        print(f"Hint: GA schedule with objective {objective} ({'feasible' if feasible else 'infeasible'})")
+        if feasible and not used_days:
+            # Objective cutoff: only solutions at least as good as the GA one (not in a rolling
+            # horizon window after the first, whose objective also counts the days already used)
+            model.Add(sum(z[d] * (d+1) for d in z) <= objective)
+    if run_incumbents is not None and run_incumbents.lower_bound is not None:
+        # Lower bound of the objective (bounds.days_bound): the search is over as soon as a
+        # solution reaches it, instead of proving its optimality
+        model.Add(sum(z[d] * (d+1) for d in z) >= run_incumbents.lower_bound)
+    print(f"Solving with CP-SAT solver")
+
+    solver.parameters.enumerate_all_solutions = False
+    # print(dir(solver.parameters))
+    solver.parameters.binary_minimization_algorithm = SatParameters.BINARY_MINIMIZATION_FIRST_WITH_TRANSITIVE_REDUCTION
+    solver.parameters.search_branching = cp_model.PORTFOLIO_SEARCH
+    # Workers, time limit, gap, presolve, LNS and parameter file from the command line
+    time_budget = run_incumbents.remaining() if run_incumbents is not None else None
+    solver_config.configure_cp(solver, args, time_budget)
+
+    if args.model_stats:
+        # The size of the presolved model is only reported in the search log
+        log_lines = []
+        solver.parameters.log_search_progress = True
+        solver.parameters.log_to_stdout = args.log
+        solver.log_callback = log_lines.append
+
+    schedule = lambda value: incumbents.schedule_from_items(data, [key for key, x_var in x.items() if value(x_var) > 0])
+    callback = solver_config.IncumbentCallback(run_incumbents, schedule)
+    if run_incumbents is not None:
+        # The stall and the budget are checked between two solutions too
+        with incumbents.watchdog(run_incumbents, solver.StopSearch):
+            status = solver.Solve(model, callback)
+    else:
+        status = solver.Solve(model, callback)
+
+    print(f"Status: {solver.StatusName(status)}")
+    if args.model_stats:
+        proto = model.Proto()
+        print(f"Model: {len(proto.variables)} variables, {len(proto.constraints)} constraints")
+        variables, constraints = presolved_model_size(log_lines)
+        print(f"Presolved model: {variables} variables, {constraints} constraints")
+
+    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+        bin_items = exact_model.get_bin_items(x, solver.value)
+        used_bins = {bin_id for bin_id, y_var in y.items() if solver.value(y_var) == 1}
+        # A solution at the lower bound is optimal even if the search was stopped before proving it
+        at_bound = run_incumbents is not None and run_incumbents.lower_bound is not None and solver.ObjectiveValue() <= run_incumbents.lower_bound
+        status_str = "feasible" if status == cp_model.FEASIBLE and not at_bound else "optimal"
+        return status_str, bin_items, used_bins, solver.WallTime()
+    return None, {}, set(), solver.WallTime()
+
+
+def main(args):
+    data = create_data_model(args, forceint=True)
+    # Bound of the whole instance, computed before the horizon is trimmed: with --tight-horizon the
+    # solvers only prove optimality within the trimmed days
+    instance_bound = bounds.days_bound(data) if args.bound or args.tight_horizon else None
+    if args.tight_horizon:
+        data = horizon.tighten(data)
+
+    # print(data["bin_days"])
+    # exit(1)
+    lower_bound = instance_bound if args.bound else None
+    run_incumbents = incumbents.Incumbents(args.incumbent_log, args.time_budget, args.target, args.stall, 'CP-SAT', lower_bound)
+    if args.decompose:
+        status_str, bin_items, used_bins, wall_time = decomposition.solve(data, functools.partial(exact_model.solve_component, args=args, solve=solve, engine='CP-SAT'), args.decompose_workers)
+    else:
+        status_str, bin_items, used_bins, wall_time = exact_model.solve_instance(data, args, run_incumbents, solve)
+    if status_str is not None:
+        # Final solution (already in the log if it was streamed by the solver)
+        items = [(j, k, i, d) for (i, d), items_bin in bin_items.items() for j, k in items_bin]
+        objective = sum(d + 1 for d in {d for (i, d) in bin_items})
+        run_incumbents.update(run_incumbents.elapsed(), objective, lambda: incumbents.schedule_from_items(data, items))
+        if lower_bound is not None:
+            print(f"Objective {objective}, lower bound {lower_bound}, gap {bounds.gap(objective, lower_bound):.2%}")
+            if objective <= lower_bound:
+                # Also for the schedules merged from windows or components
+                status_str = "optimal"
+        if args.tight_horizon and status_str == "optimal" and objective > instance_bound:
+            # Optimal for the trimmed horizon, not proven for the whole instance
+            status_str = "feasible"
+    save_solution(args.save_file, data, bin_items, used_bins, status_str, wall_time)
+
+
+if __name__ == "__main__":
+    main(args)
+    with open(f"{args.save_file}.pkl", "rb") as f:
+        ilp_data = dill.load(f)
         print(ilp_data)
\ No newline at end of file
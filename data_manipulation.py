@@ -1,116 +1,165 @@
-import pandas as pd
-import re
-from ortools.linear_solver import pywraplp
-import holidays
-
-# Funzione per estrarre il numero da una stringa come 'm1', 'm2', .. ,  'm10'
-def sort_machines_key(machine_id):
-    return int(re.findall(r'\d+', machine_id)[0])
-
-
-def create_data_model(args, forceint=False):
-    # df = pd.read_csv('2020_PatientArrivals_relaxed.csv', sep=';', header=0)
-    df = pd.read_csv(f'data/{args.arrivals_file}.csv', sep=';', header=0)
-    df_protocols = pd.read_csv('data/Protocols.csv', sep=';', header=0)
-    data = {"patients": {},
-            "bin_days": {}}
-    
-    #all_machines = df['MachineID'].unique()
-    all_machines = [f"M{i}" for i in range(1, 11)]  # Lista con tutte le macchine ordinate da M1 a M10
-    # all_machines = [f"M{i}" for i in range(1, 4)]  # Lista con tutte le macchine ordinate da M1 a M3
-    
-    all_days = [pd.to_datetime(i, unit='D', origin=pd.Timestamp('01-01-2020')).date() for i in range(365)]
-    all_days = [d for d in all_days if d not in holidays.BE(years=2020) and d.weekday() < 5]
-
-    data['day_to_actual_days'] = {i: all_days[i] for i in range(len(all_days))}
-    data['actual_days_to_day'] = {all_days[i]: i for i in range(len(all_days))}
-
-    # all_days = df['Start date'].unique()
-
-    for index, row in df.iterrows():
-        patient_id = row['PatientID']
-        no_fractions = int(row['NoFractions'])
-        session_time_first = int(row['SessionTimeFirst'])
-        session_time_second = int(row['SessionTimeSecond'])
-        protocol = row['RTTreatment']
-
-        patient_sessions = {1: session_time_first}
-
-        for i in range(2, no_fractions + 1):
-            patient_sessions[i] = session_time_second
-
-        protocol_row = df_protocols[df_protocols['RTTreatment'] == protocol].iloc[0]  # Trova la riga del protocollo
-        available_columns = df_protocols.columns
-        machines_available = {f"M{i}" for i in range(1,11) if f'M{i}' in available_columns and protocol_row[f'M{i}'] == 1}
-        # Per ordinarle in modo crescente
-        machines_available_sorted = sorted(machines_available, key=sort_machines_key)
-        data["patients"][patient_id] = {
-            "fractions": patient_sessions,
-            "machines": machines_available_sorted,
-            "arrival_day": data['actual_days_to_day'][pd.to_datetime(row['CreationDate']).date()]
-        }
-
-    # df = pd.read_csv('2020_InputScheduleFrom2019_relaxed.csv', sep=';', header=0)
-    df = pd.read_csv('data/2020_InputScheduleFrom2019.csv', sep=';', header=0)
-
-    df['Start time of appointment'] = pd.to_datetime(df['Start time of appointment'])
-    df['End time of appointment'] = pd.to_datetime(df['End time of appointment'])
-    df['Start date'] = df['Start time of appointment'].dt.date
-
-    # Assumo che una macchina venga utilizzata per 4 ore al giorno (240 minuti)
-    #total_minutes_per_day = 480
-    total_minutes_per_day = 540
-    machine_usage = df.groupby(['Start date', 'MachineID']).apply(
-        lambda x: (x['End time of appointment'] - x['Start time of appointment']).sum().total_seconds() / 60
-        , include_groups=False).to_dict()
-
-    bin_capacity = {}
-    for day in all_days:
-        for machine in all_machines:
-            if (day, machine) in machine_usage:
-                # Se la macchina è stata utilizzata, calcola la durata residua
-                used_minutes = machine_usage[(day, machine)]
-                residual_minutes = total_minutes_per_day - used_minutes
-            else:
-                # Se la macchina non è stata utilizzata, la durata residua è l'intera giornata (480 minuti)
-                residual_minutes = total_minutes_per_day
-
-            if day not in bin_capacity:
-                bin_capacity[day] = {}
-            bin_capacity[day][machine] = int(residual_minutes) if forceint else residual_minutes
-
-    # Raggruppo le macchine per ogni giorno
-    #days = df.groupby('Start date')['MachineID'].apply(lambda x: list(x.unique())).to_dict()
-
-    # Converto i giorni sequenzialmente
-    #days = {i: days[day] for i, day in enumerate(days)}
-    #days = {i: sorted(all_machines, key=sort_machines_key) for i in range(len(all_days))}
-
-    bin_capacity_sorted = {}
-
-    # Ordiniamo i giorni (le chiavi di bin_capacity) in ordine crescente
-    total_fractions = sum([len(item['fractions']) for item in data["patients"].values()])
-
-    index = 0
-    for day in sorted(bin_capacity):
-        bin_capacity_sorted[index] = {machine: bin_capacity[day][machine] for machine in
-                                    sorted(bin_capacity[day], key=sort_machines_key)}
-        index += 1
-        if index >= total_fractions:
-            break
-
-    #data['days'] = days
-    data['bin_days'] = bin_capacity_sorted
-    """
-    # Provo ad estrarre la capacità residua di una macchina in un determinato giorno
-    day = pd.to_datetime('2020-01-02').date()
-    machine_id = 'M8'
-    if day in bin_capacity and machine_id in bin_capacity[day]:
-        capacity = bin_capacity[day][machine_id]
-        print(f"La capacità residua della macchina {machine_id} nel giorno {day} è di {capacity} minuti.")
-    else:
-        print(f"Nessuna capacità trovata per la macchina {machine_id} nel giorno {day}.")
-    """
-
-    #print(data)
-    return data
\ No newline at end of file
+import pandas as pd
+import numpy as np
+import re
+import os
+import hashlib
+from pathlib import Path
+from ortools.linear_solver import pywraplp
+import holidays
+import dill
+
+# Da incrementare quando cambia il contenuto della cache dei dati preprocessati
+CACHE_VERSION = 1
+
+# Funzione per estrarre il numero da una stringa come 'm1', 'm2', .. ,  'm10'
+def sort_machines_key(machine_id):
+    return int(re.findall(r'\d+', machine_id)[0])
+
+
+def get_working_days():
+    # Giorni lavorativi del 2020 (esclusi weekend e festività in Belgio)
+    be_holidays = holidays.BE(years=2020)
+    all_days = pd.date_range('2020-01-01', periods=365, freq='D')
+    return [d for d in all_days[all_days.weekday < 5].date if d not in be_holidays]
+
+
+def get_protocol_machines(df_protocols, all_machines):
+    # Tabella protocollo -> macchine disponibili (prima riga di ogni protocollo, come in iloc[0])
+    df_protocols = df_protocols.drop_duplicates('RTTreatment').set_index('RTTreatment')
+    machine_columns = [machine for machine in all_machines if machine in df_protocols.columns]
+    eligible = (df_protocols[machine_columns] == 1).reindex(columns=all_machines, fill_value=False)
+    return eligible
+
+
+def load_columnar(arrivals_file):
+    # Legge i file di input e restituisce i dati in forma colonnare (una riga per paziente, una colonna per macchina)
+    df = pd.read_csv(f'data/{arrivals_file}.csv', sep=';', header=0)
+    df_protocols = pd.read_csv('data/Protocols.csv', sep=';', header=0)
+
+    all_machines = [f"M{i}" for i in range(1, 11)]  # Lista con tutte le macchine ordinate da M1 a M10
+    all_days = get_working_days()
+    actual_days_to_day = {all_days[i]: i for i in range(len(all_days))}
+
+    # Un paziente presente più volte mantiene la posizione della prima riga e i valori dell'ultima
+    order = df['PatientID'].drop_duplicates(keep='first')
+    df = df.drop_duplicates('PatientID', keep='last').set_index('PatientID').loc[order]
+
+    no_fractions = df['NoFractions'].astype(int).to_numpy()
+
+    df_schedule = pd.read_csv('data/2020_InputScheduleFrom2019.csv', sep=';', header=0)
+    df_schedule['Start date'] = pd.to_datetime(df_schedule['Start time of appointment']).dt.date
+    df_schedule['Minutes'] = (pd.to_datetime(df_schedule['End time of appointment']) - pd.to_datetime(df_schedule['Start time of appointment'])).dt.total_seconds() / 60
+
+    # Assumo che una macchina venga utilizzata per 9 ore al giorno (540 minuti)
+    total_minutes_per_day = 540
+    machine_usage = df_schedule.groupby(['Start date', 'MachineID'])['Minutes'].sum().unstack()
+    machine_usage = machine_usage.reindex(index=all_days, columns=all_machines)
+
+    # L'orizzonte è limitato al numero totale di frazioni
+    horizon = min(len(all_days), int(no_fractions.sum()))
+
+    return {
+        "patient_ids": df.index.to_numpy(),
+        "no_fractions": no_fractions,
+        "session_time_first": df['SessionTimeFirst'].astype(int).to_numpy(),
+        "session_time_second": df['SessionTimeSecond'].astype(int).to_numpy(),
+        "arrival_day": np.array([actual_days_to_day[d] for d in pd.to_datetime(df['CreationDate']).dt.date]),
+        "eligible": get_protocol_machines(df_protocols, all_machines).loc[df['RTTreatment']].to_numpy(),
+        "machines": np.array(all_machines),
+        "days": np.array(all_days, dtype='datetime64[D]'),
+        # Capacità residua: giornata intera se la macchina non è stata utilizzata
+        "capacity": total_minutes_per_day - machine_usage.fillna(0).to_numpy()[:horizon],
+        "used": machine_usage.notna().to_numpy()[:horizon]
+    }
+
+
+def data_from_columnar(columnar, forceint=False):
+    all_machines = columnar["machines"].tolist()
+    all_days = columnar["days"].tolist()
+    data = {"patients": {},
+            "bin_days": {}}
+
+    data['day_to_actual_days'] = {i: all_days[i] for i in range(len(all_days))}
+    data['actual_days_to_day'] = {all_days[i]: i for i in range(len(all_days))}
+
+    for k, patient_id in enumerate(columnar["patient_ids"].tolist()):
+        patient_sessions = {1: int(columnar["session_time_first"][k])}
+        patient_sessions.update(dict.fromkeys(range(2, columnar["no_fractions"][k] + 1), int(columnar["session_time_second"][k])))
+        data["patients"][patient_id] = {
+            "fractions": patient_sessions,
+            "machines": [machine for machine, available in zip(all_machines, columnar["eligible"][k]) if available],
+            "arrival_day": int(columnar["arrival_day"][k])
+        }
+
+    for day, (residual_minutes, used) in enumerate(zip(columnar["capacity"], columnar["used"])):
+        if forceint:
+            data['bin_days'][day] = dict(zip(all_machines, residual_minutes.astype(int).tolist()))
+        else:
+            # Come in precedenza, la capacità di una macchina non utilizzata resta un intero
+            data['bin_days'][day] = {machine: residual if used_machine else int(residual)
+                                     for machine, residual, used_machine in zip(all_machines, residual_minutes.tolist(), used)}
+
+    data['columnar'] = columnar
+    return data
+
+
+def get_cache_file(arrivals_file, forceint, cache_dir):
+    # La chiave dipende dal contenuto dei file di input, quindi la cache si invalida da sola quando cambiano
+    key = hashlib.sha256(f"{CACHE_VERSION}_{forceint}".encode())
+    for file_name in [f'data/{arrivals_file}.csv', 'data/Protocols.csv', 'data/2020_InputScheduleFrom2019.csv']:
+        key.update(Path(file_name).read_bytes())
+    return Path(cache_dir) / f"{key.hexdigest()}.npz"
+
+
+def create_data_model(args, forceint=False, cache_dir='data/cache'):
+    if cache_dir is None:
+        return data_from_columnar(load_columnar(args.arrivals_file), forceint)
+
+    cache_file = get_cache_file(args.arrivals_file, forceint, cache_dir)
+    if cache_file.exists():
+        with np.load(cache_file, allow_pickle=False) as cached:
+            columnar = {key: cached[key] for key in cached.files}
+    else:
+        columnar = load_columnar(args.arrivals_file)
+        cache_file.parent.mkdir(exist_ok=True, parents=True)
+        # Scrittura atomica: più esecuzioni in parallelo possono creare la stessa voce
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'wb') as handle:
+            np.savez(handle, **columnar)
+        os.replace(tmp_file, cache_file)
+
+    return data_from_columnar(columnar, forceint)
+
+
+def load_ga_schedule(ga_file, data):
+    # Frazioni (j, k, i, d) del miglior individuo salvato dagli script GA, con i giorni e le
+    # frazioni numerati come nei modelli esatti, e se la soluzione rispetta le capacità di data
+    with open(ga_file, "rb") as handle:
+        individual = dill.load(handle)['best_individual']
+
+    # Giorni (in ordine) e macchine di ogni paziente: la j-esima presenza è la frazione j
+    patient_days = {}
+    for day in individual:
+        d = data["actual_days_to_day"].get(day.date)
+        for i, machine in day.machines.items():
+            for patient in machine.get_patients():
+                patient_days.setdefault(patient.id, []).append((d, i))
+
+    # Il GA non rispetta i giorni di arrivo: una frazione è valida solo se esiste la variabile
+    # x[j, k, i, d] dei modelli esatti (macchina ammessa e giorno in fraction_days)
+    horizon = len(data["bin_days"])
+    items = set()
+    load = {}
+    feasible = patient_days.keys() == data["patients"].keys()
+    for k, days in patient_days.items():
+        for j, (d, i) in enumerate(days, start=1):
+            if d is None or d not in data["bin_days"] or k not in data["patients"] or j not in data["patients"][k]["fractions"]:
+                feasible = False
+                continue
+            item_k = data["patients"][k]
+            if i not in item_k["machines"] or not item_k["arrival_day"] + j - 1 <= d < horizon - len(item_k["fractions"]) + j:
+                feasible = False
+            items.add((j, k, i, d))
+            load[(i, d)] = load.get((i, d), 0) + data["patients"][k]["fractions"][j]
+    feasible = feasible and all(load[(i, d)] <= data["bin_days"][d][i] for (i, d) in load)
+    return items, feasible
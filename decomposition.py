@@ -0,0 +1,67 @@
+from multiprocessing import Pool
+
+
+def add_arguments(parser):
+    parser.add_argument('--decompose', dest='decompose', action='store_true',
+                        help='Solve separately the groups of patients that share no machine (connected components of the protocol-machine graph), each in its own process')
+    parser.add_argument('--decompose-workers', dest='decompose_workers', action='store',
+                        help='Number of components solved at the same time (all of them if not given)', default=None, type=int)
+
+
+def component_data(data, patients, machines):
+    # Data of a component: its patients and the capacities of its machines
+    sub_data = dict(data)
+    sub_data["patients"] = patients
+    sub_data["bin_days"] = {d: {i: space for i, space in bin_d.items() if i in machines} for d, bin_d in data["bin_days"].items()}
+    return sub_data
+
+
+def components(data):
+    # Patients linked (directly or not) by a machine they can both use are in the same component,
+    # components are sorted by total number of fractions, largest first
+    parent = {}
+
+    def find(i):
+        while parent.setdefault(i, i) != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for item_k in data["patients"].values():
+        for i in item_k["machines"][1:]:
+            parent[find(i)] = find(item_k["machines"][0])
+
+    patients = {}
+    for k, item_k in data["patients"].items():
+        patients.setdefault(find(item_k["machines"][0]), {})[k] = item_k
+    machines = {}
+    for i in parent:
+        machines.setdefault(find(i), set()).add(i)
+
+    roots = sorted(patients, key=lambda root: -sum(len(item_k["fractions"]) for item_k in patients[root].values()))
+    return [component_data(data, patients[root], machines[root]) for root in roots]
+
+
+def solve(data, solve_component, workers=None):
+    # Solve each component with solve_component(sub_data) in a process pool and merge the schedules.
+    # solve_component must be picklable and return (status_str, bin_items, used_bins, wall_time)
+    # with status_str None if no solution was found
+    parts = components(data)
+    for c, sub_data in enumerate(parts):
+        machines = sorted(next(iter(sub_data["bin_days"].values())))
+        print(f"Component {c}: {len(sub_data['patients'])} patients on {', '.join(machines)}")
+    if len(parts) == 1:
+        return solve_component(parts[0])
+
+    with Pool(workers or len(parts)) as pool:
+        results = pool.map(solve_component, parts)
+
+    # The components run at the same time: the wall time is the one of the slowest
+    wall_time = max(result[3] for result in results)
+    if any(status_str is None for status_str, bin_items, used_bins, component_time in results):
+        return None, {}, set(), wall_time
+    bin_items = {bin_id: items for result in results for bin_id, items in result[1].items()}
+    used_bins = {bin_id for result in results for bin_id in result[2]}
+    # The machines of the components are disjoint but their days are not: a day used by two
+    # components is paid once, so the union of optimal schedules is feasible but not optimal in general
+    return "feasible", bin_items, used_bins, wall_time
@@ -0,0 +1,184 @@
+# Models and solve loop shared by complex_bin_packing.py (pywraplp) and complex_bin_packing_cp.py (CP-SAT)
+import rolling_horizon
+import incumbents
+import bounds
+
+
+def fraction_days(item_k, j, horizon):
+    # Days in which fraction j of patient k can be packed: the first fraction not before the arrival
+    # day and each fraction one day after the previous one, with all the fractions within the horizon
+    return range(item_k["arrival_day"] + j - 1, horizon - len(item_k["fractions"]) + j)
+
+
+def build_model(model, data, new_var):
+    # model is a pywraplp solver or a CP-SAT model, new_var(name) creates a 0-1 variable in it
+    horizon = len(data["bin_days"])
+
+    # Variables
+    # x[j,k,i,d] = 1 if item j of patient k is packed in bin i of day d.
+    # Only created for the machines allowed by the protocol of patient k and for the days
+    # in which fraction j can be packed, all the others would be fixed to 0.
+    x = {}
+    for k, item_k in data["patients"].items():
+        for j in item_k["fractions"]:
+            for d in fraction_days(item_k, j, horizon):
+                for i in item_k["machines"]:
+                    x[(j, k, i, d)] = new_var(f"x_{j}_{k}_{i}_{d}")
+
+    # y[i, d] = 1 if bin i is used in day d.
+    y = {}
+    for d, bin_d in data["bin_days"].items():
+        for i in bin_d:
+            y[(i, d)] = new_var(f"y_{i}_{d}")
+
+    # z[d] = 1 if a bin of day d is used
+    z = {}
+    for d, bin_d in data["bin_days"].items():
+        z[d] = new_var(f"z_{d}")
+
+    # Constraints
+    # Each item of each patient must be in exactly one bin in one day.
+    for k, item_k in data["patients"].items():
+        for j in item_k["fractions"]:
+            model.Add(sum(x[j, k, i, d] for d in fraction_days(item_k, j, horizon) for i in item_k["machines"]) == 1)
+
+    # Z[d] is 1 if a bin of day d is used (z[d] = min(1, sum(y[i, d] for i in bin_d)) linearized)
+    for d, bin_d in data["bin_days"].items():
+        model.Add(sum(y[i, d] for i in bin_d) <= len(bin_d) * z[d])
+        model.Add(1 - sum(y[i, d] for i in bin_d) <= len(bin_d) * (1 - z[d]))
+
+    # The amount packed in each bin cannot exceed its capacity.
+    bin_items = {(i, d): [] for d, bin_d in data["bin_days"].items() for i in bin_d}
+    for (j, k, i, d) in x:
+        bin_items[(i, d)].append((j, k))
+    for (i, d), items in bin_items.items():
+        model.Add(
+            sum(x[(j, k, i, d)] * data["patients"][k]["fractions"][j] for j, k in items) <= y[(i, d)] * data["bin_days"][d][i]
+        )
+
+    # Items must be packed consecutively day by day: item j before item j+1
+    for k, item_k in data["patients"].items():
+        for j in item_k["fractions"]:
+            if j + 1 in item_k["fractions"]:
+                for d in fraction_days(item_k, j, horizon):
+                    model.Add(
+                        sum(x[(j, k, i, d)] for i in item_k["machines"]) ==
+                        sum(x[(j + 1, k, i, d + 1)] for i in item_k["machines"])
+                    )
+
+    # Objective: minimize the number of days used
+    model.Minimize(sum(z[d] * (d+1) for d, bin_d in data["bin_days"].items()))
+
+    return x, y, z
+
+
+def build_start_model(model, data, new_var):
+    # Start-day formulation: the fractions of a patient are consecutive, so its schedule is given
+    # by its start day and the machine of each fraction
+    horizon = len(data["bin_days"])
+
+    # Variables
+    # s[k,d] = 1 if patient k starts the treatment on day d.
+    s = {}
+    for k, item_k in data["patients"].items():
+        for d in fraction_days(item_k, 1, horizon):
+            s[(k, d)] = new_var(f"s_{k}_{d}")
+
+    # x[j,k,i,d] = 1 if item j of patient k is packed in bin i of day d. For the patients
+    # with a single allowed machine this is the start variable of day d - j + 1 itself,
+    # a new variable is created only when there is a choice of machine.
+    x = {}
+    for k, item_k in data["patients"].items():
+        for j in item_k["fractions"]:
+            for d in fraction_days(item_k, j, horizon):
+                for i in item_k["machines"]:
+                    if len(item_k["machines"]) == 1:
+                        x[(j, k, i, d)] = s[(k, d - j + 1)]
+                    else:
+                        x[(j, k, i, d)] = new_var(f"x_{j}_{k}_{i}_{d}")
+
+    # y[i, d] = 1 if bin i is used in day d.
+    y = {}
+    for d, bin_d in data["bin_days"].items():
+        for i in bin_d:
+            y[(i, d)] = new_var(f"y_{i}_{d}")
+
+    # z[d] = 1 if a bin of day d is used
+    z = {}
+    for d, bin_d in data["bin_days"].items():
+        z[d] = new_var(f"z_{d}")
+
+    # Constraints
+    # Each patient starts exactly once.
+    for k, item_k in data["patients"].items():
+        model.Add(sum(s[(k, d)] for d in fraction_days(item_k, 1, horizon)) == 1)
+
+    # Fraction j of patient k is packed on day d (in one of its machines) iff k starts on day d - j + 1.
+    for k, item_k in data["patients"].items():
+        if len(item_k["machines"]) > 1:
+            for j in item_k["fractions"]:
+                for d in fraction_days(item_k, j, horizon):
+                    model.Add(sum(x[(j, k, i, d)] for i in item_k["machines"]) == s[(k, d - j + 1)])
+
+    # Z[d] is 1 if a bin of day d is used (z[d] = min(1, sum(y[i, d] for i in bin_d)) linearized)
+    for d, bin_d in data["bin_days"].items():
+        model.Add(sum(y[i, d] for i in bin_d) <= len(bin_d) * z[d])
+        model.Add(1 - sum(y[i, d] for i in bin_d) <= len(bin_d) * (1 - z[d]))
+
+    # The amount packed in each bin cannot exceed its capacity.
+    bin_items = {(i, d): [] for d, bin_d in data["bin_days"].items() for i in bin_d}
+    for (j, k, i, d) in x:
+        bin_items[(i, d)].append((j, k))
+    for (i, d), items in bin_items.items():
+        model.Add(
+            sum(x[(j, k, i, d)] * data["patients"][k]["fractions"][j] for j, k in items) <= y[(i, d)] * data["bin_days"][d][i]
+        )
+
+    # Objective: minimize the number of days used
+    model.Minimize(sum(z[d] * (d+1) for d, bin_d in data["bin_days"].items()))
+
+    return x, y, z
+
+
+def get_hint(items, x, y, z):
+    # Value of each variable (once, x can alias the same variable more than once) in the
+    # schedule where the items (j, k, i, d) are packed, and objective of the schedule
+    used_bins = {(i, d) for (j, k, i, d) in items}
+    used_days = {d for (i, d) in used_bins}
+    hint = {}
+    for key, x_var in x.items():
+        hint[id(x_var)] = (x_var, max(hint.get(id(x_var), (x_var, 0))[1], int(key in items)))
+    for key, y_var in y.items():
+        hint[id(y_var)] = (y_var, int(key in used_bins))
+    for d, z_var in z.items():
+        hint[id(z_var)] = (z_var, int(d in used_days))
+    return list(hint.values()), sum(d + 1 for d in used_days)
+
+
+def get_bin_items(x, value):
+    # Items (j, k) packed in each bin (i, d) of the solution
+    bin_items = {}
+    for (j, k, i, d), x_var in x.items():
+        if value(x_var) > 0:
+            bin_items.setdefault((i, d), []).append((j, k))
+    return bin_items
+
+
+def solve_instance(data, args, run_incumbents, solve):
+    # solve(data, args, used_days, hint_file, run_incumbents) is the solve function of the script
+    # Whole instance at once, or window by window (rolling horizon)
+    if args.window is not None:
+        # The windows share the time budget of the run, each with a stall rule of its own (CP-SAT only),
+        # and start from the part of the GA schedule of their patients
+        def solve_window(window_data, used_days):
+            window_incumbents = incumbents.Incumbents(None, run_incumbents.remaining(), None, args.stall, run_incumbents.engine)
+            return solve(window_data, args, used_days, hint_file=args.hint_file, run_incumbents=window_incumbents)
+        return rolling_horizon.solve(data, solve_window, args.window, args.overlap, lambda: run_incumbents.remaining() == 0)
+    return solve(data, args, hint_file=args.hint_file, run_incumbents=run_incumbents)
+
+
+def solve_component(data, args, solve, engine):
+    # Component of a decomposed instance, solved in its own process: time budget and lower bound
+    # of its own, its solutions are not streamed to the incumbent log
+    lower_bound = bounds.days_bound(data) if args.bound else None
+    return solve_instance(data, args, incumbents.Incumbents(None, args.time_budget, None, args.stall, engine, lower_bound), solve)
@@ -0,0 +1,505 @@
+from typing import List, Dict
+import datetime
+import random
+import time
+from contextlib import nullcontext
+import numpy as np
+from tqdm import tqdm
+import ga_parallel
+from horizon import first_fit
+
+
+def add_arguments(parser):
+    # Options shared by the two GA versions
+    parser.add_argument('--tournament-size', dest='tournament_size', action='store',
+                        help='Number of individuals in each selection tournament', default=2, type=int)
+    parser.add_argument('--selection-pressure', dest='selection_pressure', action='store',
+                        help='Probability that the best individual of a tournament wins (1 for deterministic tournaments)', default=1.0, type=float)
+    parser.add_argument('--islands', dest='islands_num', action='store',
+                        help='Number of islands, each evolved in its own process (single population if not given)', default=None, type=int)
+    parser.add_argument('--migration-interval', dest='migration_interval', action='store',
+                        help='Generations between two migrations of the island model', default=10, type=int)
+    parser.add_argument('--topology', dest='topology', action='store',
+                        help='Migration topology of the island model (either ring or full)', default='ring', choices=['ring', 'full'])
+    parser.add_argument('--migrants', dest='migrants_num', action='store',
+                        help='Number of best individuals sent by each island at every migration', default=1, type=int)
+    parser.add_argument('--history', dest='history', action='store',
+                        help='Convergence history to save: full (best and worst individual of each generation) or scalars (per-generation statistics only)', default='full', choices=['full', 'scalars'])
+    parser.add_argument('--checkpoint-interval', dest='checkpoint_interval', action='store',
+                        help='Generations between two saved best individuals with --history scalars (final one only if not given)', default=None, type=int)
+    parser.add_argument('--mutation', dest='mutation_operator', action='store',
+                        help='Mutation operator: shift a patient moving only the fractions at the ends and keeping its machines (delta) or remove and re-add it with new random machines (reassign, the original operator)', default='reassign', choices=['reassign', 'delta'])
+    parser.add_argument('--benchmark-mutation', dest='benchmark_mutation', action='store',
+                        help='Only time this many calls of each mutation operator on the initial population', default=None, type=int)
+    parser.add_argument('--greedy', dest='greedy_fraction', action='store',
+                        help='Fraction of the initial population built by first fit on the machine capacities (the rest is random)', default=0, type=float)
+
+
+# Per-generation statistics saved with --history scalars (overflows and makespan of the best individual)
+HISTORY_DTYPE = [('best', float), ('mean', float), ('worst', float), ('std', float), ('overflows', int), ('makespan', int), ('time', float)]
+
+class Fraction:
+    def __init__(self, patient_id, id, size = 5):
+        self.patient_id = patient_id
+        self.id = id
+        self.size = size
+
+    def __eq__(self, other):
+        if not isinstance(other, Fraction):
+            return False
+        return self.patient_id == other.patient_id and self.id == other.id and self.size == other.size
+
+    def __hash__(self):
+        return hash(f"{self.patient_id}_{self.id}")
+    
+    def __repr__(self):
+        return f"{self.patient_id}_fraction_{self.id}_{self.size}"
+
+class Patient:
+    def __init__(self, id, fractions: List[int], machines: List[str]):
+        self.id = id
+        self.fractions = []
+        for i in range(len(fractions)):
+            self.fractions.append(Fraction(self.id, i, fractions[i]))
+        self.machines = machines
+
+    def get_fractions(self):
+        return self.fractions
+    
+    def get_machines(self):
+        return self.machines
+    
+    def __eq__(self, other):
+        if not isinstance(other, Patient):
+            return False
+        return self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+    
+    def __repr__(self):
+        return f"patient_{self.id}"
+
+class Machine:
+    def __init__(self, id, capacity = 100):
+        self.id = id
+        self.patients = set()
+        self.start_patients = set()
+        self.capacity = capacity
+        self.occupation = 0
+
+    def get_patients(self):
+        return self.patients
+    
+    def get_start_patients(self):
+        return self.start_patients
+    
+    def add_patient(self, patient: Patient, fraction: Fraction):
+        self.patients.add(patient)
+        self.occupation += fraction.size
+    
+    def add_start_patient(self, patient: Patient):
+        self.start_patients.add(patient)
+
+    def remove_patient(self, patient: Patient, fraction: Fraction):
+        self.patients.remove(patient)
+        self.occupation -= fraction.size
+
+    def remove_start_patient(self, patient: Patient):
+        self.start_patients.remove(patient)
+
+    def getRemaininSpace(self):
+        return self.capacity - self.occupation
+
+    def copy(self):
+        machine = Machine(self.id, self.capacity)
+        machine.patients = set(self.patients)
+        machine.start_patients = set(self.start_patients)
+        machine.occupation = self.occupation
+        return machine
+
+class Day:
+    def __init__(self, id, date: datetime, machines : Dict[str, Machine]):
+        self.id = id
+        self.date = date
+        self.machines = machines
+
+    def find_patient_machine(self, patient: Patient):
+        machine = [key for key, value in self.machines.items() if patient in value.get_patients()]
+        if len(machine) != 1:
+            raise NotImplementedError
+        
+        return machine[0]
+
+    def copy(self):
+        return Day(self.id, self.date, {key: machine.copy() for key, machine in self.machines.items()})
+
+class Individual(list):
+    # List of days that can share Day objects with other individuals (copy-on-write):
+    # a day is copied the first time it is modified by an individual that does not own it.
+    # The fitness terms (last used day and number of overflowing machines) are kept up to date
+    # by add_patient/remove_patient, so that the fitness is never recomputed from scratch.
+    # starts maps each patient to its start day and the machine of each fraction
+    def __init__(self, days: List[Day] = ()):
+        super().__init__(days)
+        self.owned = set(range(len(self)))
+        self.starts = {}
+        self.used_machines = [sum([1 for machine in day.machines.values() if machine.occupation > 0]) for day in self]
+        self.overflows = sum([1 for day in self for machine in day.machines.values() if machine.getRemaininSpace() < 0])
+        self.last_day = max([d for d, used in enumerate(self.used_machines) if used > 0], default=-1)
+        self.fitness = None
+
+    def fork(self):
+        child = Individual()
+        child.extend(self)
+        # From now on every day is shared, neither parent nor child can modify it in place
+        child.owned = set()
+        self.owned = set()
+        child.starts = dict(self.starts)
+        child.used_machines = list(self.used_machines)
+        child.overflows = self.overflows
+        child.last_day = self.last_day
+        child.fitness = self.fitness
+        return child
+
+    def get_day(self, index):
+        if index not in self.owned:
+            self[index] = self[index].copy()
+            self.owned.add(index)
+        return self[index]
+
+    def add_patient(self, index, machine_id, patient: Patient, fraction: Fraction):
+        machine = self.get_day(index).machines[machine_id]
+        used, overflowing = machine.occupation > 0, machine.getRemaininSpace() < 0
+        machine.add_patient(patient, fraction)
+        self.update_fitness_terms(index, machine, used, overflowing)
+
+    def remove_patient(self, index, machine_id, patient: Patient, fraction: Fraction):
+        machine = self.get_day(index).machines[machine_id]
+        used, overflowing = machine.occupation > 0, machine.getRemaininSpace() < 0
+        machine.remove_patient(patient, fraction)
+        self.update_fitness_terms(index, machine, used, overflowing)
+
+    def update_fitness_terms(self, index, machine: Machine, used, overflowing):
+        self.used_machines[index] += (machine.occupation > 0) - used
+        self.overflows += (machine.getRemaininSpace() < 0) - overflowing
+        if self.used_machines[index] > 0:
+            self.last_day = max(self.last_day, index)
+        else:
+            while self.last_day >= 0 and self.used_machines[self.last_day] == 0:
+                self.last_day -= 1
+        self.fitness = None
+
+class GA():
+    def __init__(self, patients: List[Patient], machines: List[Dict[str, int]], days, population_size, generations, mutation_rate, crossover_rate, tournament_size = 2, offspring_num = None, workers = None, selection_pressure = 1, history = 'full', checkpoint_interval = None, mutation_operator = 'reassign', greedy_fraction = 0):
+        self.patients = patients
+        self.population_size = population_size
+        self.generations = generations
+        self.mutation_rate = mutation_rate
+        self.crossover_rate = crossover_rate
+        self.tournament_size = tournament_size
+        self.selection_pressure = selection_pressure
+        if offspring_num is not None:
+            self.offspring_num = offspring_num
+        else:
+            self.offspring_num = int(population_size/2)
+        self.workers = workers
+        self.history = history
+        self.checkpoint_interval = checkpoint_interval
+        self.mutation_operator = mutation_operator
+        self.greedy_fraction = greedy_fraction
+        self.population = self.create_population(patients, machines, days)
+
+    def add_start_patient(self, patient: Patient, individual: Individual, index):
+        machine_chosen = random.sample(patient.get_machines(), 1)[0]
+        individual.get_day(index).machines[machine_chosen].add_start_patient(patient)
+
+        all_fractions = patient.get_fractions()
+        machines = []
+        for i, fraction in enumerate(all_fractions):
+            try:
+                individual.add_patient(i+index, machine_chosen, patient, fraction)
+            except IndexError:
+                print(len(individual), index, i)
+                raise IndexError
+            machines.append(machine_chosen)
+            machine_chosen = random.sample(patient.get_machines(), 1)[0]
+        individual.starts[patient] = (index, tuple(machines))
+
+    def remove_start_patient(self, patient: Patient, individual: Individual, index_day, index_machine):
+        individual.get_day(index_day).machines[index_machine].remove_start_patient(patient)
+
+        all_fractions = patient.get_fractions()
+        machines = individual.starts.pop(patient)[1]
+        for i, fraction in enumerate(all_fractions):
+            individual.remove_patient(i+index_day, machines[i], patient, fraction)
+
+    def shift_start_patient(self, patient: Patient, individual: Individual, new_index):
+        # Move the treatment of patient to start on new_index keeping its machines. Where the old
+        # and new days overlap each day keeps its machine (the machines are rotated by the shift),
+        # so only the fractions at the two ends move and the other days are touched only if the
+        # size of the fraction packed there changes
+        index, machines = individual.starts.pop(patient)
+        fractions = patient.get_fractions()
+        shift = new_index - index
+        new_machines = machines[shift:] + machines[:shift] if abs(shift) < len(fractions) else machines
+        old_days = {index + j: (machines[j], fraction) for j, fraction in enumerate(fractions)}
+        new_days = {new_index + j: (new_machines[j], fraction) for j, fraction in enumerate(fractions)}
+
+        individual.get_day(index).machines[machines[0]].remove_start_patient(patient)
+        for d, (machine_id, fraction) in old_days.items():
+            if d not in new_days or new_days[d][1].size != fraction.size:
+                individual.remove_patient(d, machine_id, patient, fraction)
+        for d, (machine_id, fraction) in new_days.items():
+            if d not in old_days or old_days[d][1].size != fraction.size:
+                individual.add_patient(d, machine_id, patient, fraction)
+        individual.get_day(new_index).machines[new_machines[0]].add_start_patient(patient)
+        individual.starts[patient] = (new_index, new_machines)
+
+    def place_start_patient(self, patient: Patient, individual: Individual, index, machines):
+        # As add_start_patient, with the machine of each fraction given
+        individual.get_day(index).machines[machines[0]].add_start_patient(patient)
+        for i, fraction in enumerate(patient.get_fractions()):
+            individual.add_patient(i+index, machines[i], patient, fraction)
+        individual.starts[patient] = (index, tuple(machines))
+
+    def start_index(self, individual: Individual, patient: Patient):
+        # Random start day of a patient placed at random, defined by each GA version
+        raise NotImplementedError
+
+    def add_patients_first_fit(self, individual: Individual, patients: List[Patient]):
+        # Patients placed in the given order by first_fit on the space left in individual, or at a
+        # random start with random machines (as in a random individual) if they do not fit anywhere
+        machine_ids = list(individual[0].machines.keys())
+        machine_index = {key: i for i, key in enumerate(machine_ids)}
+        residual = np.array([[day.machines[key].getRemaininSpace() for key in machine_ids] for day in individual], dtype=float)
+        for patient in patients:
+            sizes = np.array([fraction.size for fraction in patient.get_fractions()], dtype=float)
+            placement = first_fit(residual, [machine_index[key] for key in patient.get_machines()], sizes)
+            if placement is None:
+                index = self.start_index(individual, patient)
+                self.add_start_patient(patient, individual, index)
+                machines = [machine_index[key] for key in individual.starts[patient][1]]
+            else:
+                index, machines = placement
+                self.place_start_patient(patient, individual, index, [machine_ids[i] for i in machines])
+            residual[index + np.arange(len(sizes)), machines] -= sizes
+
+    def create_population(self, patients: List[Patient], machines_list: List[Dict[str, int]], days):
+        # also try shuffling n times the items and applying first fit
+        total_fractions = sum([len(patient.get_fractions()) for patient in patients])
+        population = []
+        # all_days = [pd.to_datetime(i, unit='D', origin=pd.Timestamp('01-01-2020')).date() for i in range(total_fractions*2)]
+        # all_days = [d for d in all_days if d not in holidays.BE(years=2020) and d.weekday() < 5][:total_fractions]
+        all_days = days[:min(total_fractions, len(machines_list))]
+        population = []
+
+        # The first greedy_fraction of the population is built by first fit: longest treatments
+        # first for the first individual, the patients shuffled for the others
+        greedy_num = round(self.greedy_fraction * self.population_size)
+        longest_first = sorted(patients, key = lambda patient: sum(fraction.size for fraction in patient.get_fractions()), reverse=True)
+
+        for p in range(self.population_size):
+            machines = [{key: Machine(key, value) for key, value in machines.items()} for machines in machines_list]
+            individual = Individual([Day(i, day, machines[i]) for i, day in enumerate(all_days)])
+            if p < greedy_num:
+                self.add_patients_first_fit(individual, longest_first if p == 0 else random.sample(patients, len(patients)))
+                population.append(individual)
+                continue
+            for patient in patients:
+                self.add_start_patient(patient, individual, self.start_index(individual, patient))
+            population.append(individual)
+
+        return population
+
+    def find_patient_start_day_and_machine(self, individual: Individual, patient: Patient):
+        if patient not in individual.starts:
+            raise NotImplementedError
+        index, machines = individual.starts[patient]
+        return index, machines[0]
+
+    def crossover(self, parent1: Individual, parent2: Individual):
+        # Children share the parents' days, only the days touched by the swapped patients get copied
+        child1 = parent1.fork()
+        child2 = parent2.fork()
+
+        if random.random() > self.crossover_rate:
+            cross_patients = random.sample(self.patients, random.randint(1, min(3, len(self.patients))))
+
+            for cross_p in cross_patients:
+                d_start_1_ind, ind_mach_1 = self.find_patient_start_day_and_machine(child1, cross_p)
+                d_start_2_ind, ind_mach_2 = self.find_patient_start_day_and_machine(child2, cross_p)
+
+                self.remove_start_patient(cross_p, child1, d_start_1_ind, ind_mach_1)
+                self.add_start_patient(cross_p, child1, d_start_2_ind)
+
+                self.remove_start_patient(cross_p, child2, d_start_2_ind, ind_mach_2)
+                self.add_start_patient(cross_p, child2, d_start_1_ind)
+
+            # if sum([1 for day in child1[21:] if len(day.patients) > 0]) > 0 or sum([1 for day in child2[21:] if len(day.patients) > 0]) > 0:
+            #     raise NotImplementedError
+            
+        return child1, child2
+
+    def mutation(self, individual: Individual):
+        # Shift of the start day of a random patient, defined by each GA version
+        raise NotImplementedError
+
+    def get_fitness(self, individual: Individual):
+        # Last used day (1-based) plus a penalty of 50 for each overflowing machine
+        if individual.fitness is None:
+            individual.fitness = individual.last_day + 1 + 50 * individual.overflows
+
+        return individual.fitness
+
+    def evaluate_population(self, population = None):
+        if population is None:
+            population = self.population
+        return np.array([self.get_fitness(individual) for individual in population])
+
+    def sort_population(self, fitness = None):
+        if fitness is None:
+            fitness = self.evaluate_population()
+        return [self.population[i] for i in np.argsort(fitness, kind='stable')]
+
+    def tournament_selection(self, fitness = None):
+        # The best of k individuals wins with probability selection_pressure,
+        # otherwise the second best with probability selection_pressure, and so on
+        k = self.tournament_size
+        n = self.offspring_num
+
+        if k < 1 or k > len(self.population):
+            raise NotImplementedError
+        if fitness is None:
+            fitness = self.evaluate_population()
+        parents = []
+        for i in range(n):
+            contestants = np.array(random.sample(range(len(self.population)), k))
+            if self.selection_pressure >= 1:
+                winner = contestants[np.argmin(fitness[contestants])]
+            else:
+                ranked = contestants[np.argsort(fitness[contestants], kind='stable')]
+                rank = 0
+                while rank < k - 1 and random.random() >= self.selection_pressure:
+                    rank += 1
+                winner = ranked[rank]
+            parents.append(self.population[winner])
+        
+        return parents
+
+    def reset_history(self):
+        self.best = {'fitness': [], 'individual': []}
+        self.worst = {'fitness': [], 'individual': []}
+        self.mean = []
+        self.scalars = np.zeros(self.generations + 1, dtype=HISTORY_DTYPE) if self.history == 'scalars' else None
+        self.checkpoints = {}
+
+    def record(self, generation, start_time):
+        fitness = self.evaluate_population()
+        order = np.argsort(fitness, kind='stable')
+        best_individual = self.population[order[0]]
+        if self.history == 'scalars':
+            self.scalars[generation] = (fitness[order[0]], np.mean(fitness), fitness[order[-1]], np.std(fitness),
+                                        best_individual.overflows, best_individual.last_day + 1, time.time() - start_time)
+            if self.checkpoint_interval and generation % self.checkpoint_interval == 0:
+                self.checkpoints[generation] = self.snapshot(best_individual)
+            return fitness[order[0]], best_individual
+
+        self.worst['fitness'].append(int(fitness[order[-1]]))
+        self.worst['individual'].append(self.population[order[-1]])
+        self.best['fitness'].append(int(fitness[order[0]]))
+        self.best['individual'].append(best_individual)
+        self.mean.append(np.mean(fitness))
+        return fitness[order[0]], best_individual
+
+    def history_results(self):
+        if self.history == 'scalars':
+            return {'fitness': self.scalars['best']}, {'fitness': self.scalars['worst']}, self.scalars['mean']
+        return self.best, self.worst, self.mean
+
+    def run(self, incumbents = None):
+        # incumbents (incumbents.Incumbents) streams every improving best individual and stops
+        # the run early on time budget, target fitness, stall generations or when the best
+        # fitness reaches its lower bound (the gap is shown on the progress bar)
+        start_time = time.time()
+        self.reset_history()
+
+        with ga_parallel.create_pool(self, self.workers) if self.workers else nullcontext() as pool:
+            progress = tqdm(range(self.generations + 1))
+            for generation in progress:
+                if generation > 0:
+                    self.step(pool)
+                best_fitness, best_individual = self.record(generation, start_time)
+                if incumbents is not None:
+                    improved = incumbents.update(generation, best_fitness, lambda: self.schedule(best_individual))
+                    if improved and incumbents.lower_bound is not None:
+                        progress.set_postfix(best=int(best_fitness), gap=f"{incumbents.gap():.2%}", refresh=False)
+                    if incumbents.done(generation):
+                        break
+
+        if self.history == 'scalars':
+            self.scalars = self.scalars[:generation + 1]
+
+        exe_time = time.time() - start_time
+        best, worst, mean = self.history_results()
+        return self.population, [self.get_fitness(individual) for individual in self.population], best, worst, mean, exe_time
+
+    def step(self, pool = None):
+        # if sum([sum([1 for day in individual[21:] if len(day.patients) > 0]) for individual in self.population]) > 0:
+        #     raise NotImplementedError
+        # TODO: use crossover rate
+        fitness = self.evaluate_population()
+        parents = self.tournament_selection(fitness)
+        if pool is not None:
+            sorted_pop = self.sort_population(fitness)
+            survivors = sorted_pop[:len(sorted_pop)-self.offspring_num]
+            self.population = ga_parallel.vary_population(self, pool, parents, survivors)
+            return
+
+        offspring = []
+        for i in range(0, len(parents), 2):
+            child1, child2 = self.crossover(parents[i], parents[i+1])
+            offspring.append(child1)
+            offspring.append(child2)
+        sorted_pop = self.sort_population(fitness)
+        self.population = sorted_pop[:len(sorted_pop)-self.offspring_num] + offspring
+        for i in range(len(self.population)):
+            if random.random() >= self.mutation_rate:
+                self.population[i] = self.mutation(self.population[i])
+
+    def vary(self, individuals):
+        # Crossover (for a pair of parents), mutation and fitness of the resulting individuals
+        if len(individuals) == 2:
+            individuals = list(self.crossover(individuals[0], individuals[1]))
+        for i in range(len(individuals)):
+            if random.random() >= self.mutation_rate:
+                individuals[i] = self.mutation(individuals[i])
+            self.get_fitness(individuals[i])
+
+        return individuals
+
+    def reseed(self, seed):
+        random.seed(seed)
+
+    def schedule(self, individual: Individual):
+        # Compact schedule {patient: [start date, machine of each fraction]}
+        return {patient.id: [str(individual[index].date), list(machines)] for patient, (index, machines) in individual.starts.items()}
+
+    def snapshot(self, individual: Individual):
+        # Copy of the individual that is not affected by the following generations
+        return individual.fork()
+
+    def export(self, individual):
+        return individual
+
+
+def benchmark_mutation(alg: GA, calls):
+    # Average time of a mutation call with each operator, every call on a fresh copy of an
+    # individual of the population (as offspring are mutated once per generation)
+    for operator in ['reassign', 'delta']:
+        alg.mutation_operator = operator
+        individuals = [alg.snapshot(alg.population[i % len(alg.population)]) for i in range(calls)]
+        start_time = time.time()
+        for individual in individuals:
+            alg.mutation(individual)
+        print(f"Mutation {operator}: {(time.time() - start_time) / calls * 1e6:.1f} us per call")
@@ -0,0 +1,120 @@
+import math
+import random
+import time
+from multiprocessing import Pipe, Process
+import numpy as np
+from tqdm import tqdm
+
+
+def neighbours(island, islands_num, topology):
+    # Islands sending their best individuals to the given island
+    if topology == 'ring':
+        return [(island - 1) % islands_num]
+    return [i for i in range(islands_num) if i != island]
+
+
+def evolve_island(ga, seed, conn, migration_interval, migrants_num):
+    start_time = time.time()
+    ga.reseed(seed)
+    ga.reset_history()
+    ga.record(0, start_time)
+
+    generation = 0
+    for generation in range(1, ga.generations + 1):
+        ga.step()
+        ga.record(generation, start_time)
+
+        # Migration every migration_interval generations (not after the last one). The best
+        # individual is always sent, for the stop rules applied by the main process, which
+        # answers None when the run is over
+        if generation % migration_interval == 0 and generation < ga.generations:
+            sorted_pop = ga.sort_population()
+            conn.send(sorted_pop[:max(migrants_num, 1)])
+            immigrants = conn.recv()
+            if immigrants is None:
+                break
+            # The immigrants replace the worst individuals of the island
+            replaced = min(len(immigrants), len(sorted_pop) - 1)
+            ga.population = sorted_pop[:len(sorted_pop)-replaced] + immigrants[:replaced]
+
+    if ga.history == 'scalars':
+        ga.scalars = ga.scalars[:generation + 1]
+    conn.send((ga.population, ga.best, ga.worst, ga.mean, ga.scalars, ga.checkpoints))
+    conn.close()
+
+
+def merge_scalars(islands_scalars):
+    # Statistics of the union of the islands (all with the same population size)
+    stacked = np.stack(islands_scalars)
+    best_island = np.argmin(stacked['best'], axis=0)
+    generations = np.arange(stacked.shape[1])
+    scalars = np.zeros_like(islands_scalars[0])
+    scalars['best'] = stacked['best'].min(axis=0)
+    scalars['mean'] = stacked['mean'].mean(axis=0)
+    scalars['worst'] = stacked['worst'].max(axis=0)
+    scalars['std'] = np.sqrt(np.maximum((stacked['std'] ** 2 + stacked['mean'] ** 2).mean(axis=0) - scalars['mean'] ** 2, 0))
+    scalars['overflows'] = stacked['overflows'][best_island, generations]
+    scalars['makespan'] = stacked['makespan'][best_island, generations]
+    scalars['time'] = stacked['time'].max(axis=0)
+    return scalars, best_island
+
+
+def run(algs, migration_interval, topology='ring', migrants_num=1, incumbents=None):
+    # Evolve each GA of algs as an island in its own process, exchanging the best
+    # migrants_num individuals every migration_interval generations. The stop rules of
+    # incumbents (incumbents.Incumbents) are checked on the best individual of all the
+    # islands at every migration, and all the islands stop together
+    start_time = time.time()
+    generations = algs[0].generations
+
+    conns = []
+    processes = []
+    for ga in algs:
+        parent_conn, child_conn = Pipe()
+        process = Process(target=evolve_island, args=(ga, random.getrandbits(64), child_conn, migration_interval, migrants_num))
+        process.start()
+        conns.append(parent_conn)
+        processes.append(process)
+
+    ga = algs[0]
+    migrations = max(math.ceil(generations / migration_interval) - 1, 0)
+    for migration in tqdm(range(1, migrations + 1)):
+        emigrants = [conn.recv() for conn in conns]
+        stop = False
+        if incumbents is not None:
+            best_individual = min((individuals[0] for individuals in emigrants), key = lambda a: ga.get_fitness(a))
+            incumbents.update(migration * migration_interval, ga.get_fitness(best_individual), lambda: ga.schedule(best_individual))
+            stop = incumbents.done(migration * migration_interval)
+        for i, conn in enumerate(conns):
+            conn.send(None if stop else [individual for j in neighbours(i, len(conns), topology) for individual in emigrants[j][:migrants_num]])
+        if stop:
+            break
+
+    results = [conn.recv() for conn in conns]
+    for process in processes:
+        process.join()
+
+    population = [individual for result in results for individual in result[0]]
+    if ga.history == 'scalars':
+        ga.scalars, best_island = merge_scalars([result[4] for result in results])
+        # Checkpoint of the island with the best individual at that generation
+        ga.checkpoints = {generation: results[best_island[generation]][5][generation] for generation in results[0][5]}
+    else:
+        ga.reset_history()
+        # All the islands stop at the same generation
+        for generation in range(len(results[0][3])):
+            best_result = min(results, key = lambda a: a[1]['fitness'][generation])
+            worst_result = max(results, key = lambda a: a[2]['fitness'][generation])
+            ga.best['fitness'].append(best_result[1]['fitness'][generation])
+            ga.best['individual'].append(best_result[1]['individual'][generation])
+            ga.worst['fitness'].append(worst_result[2]['fitness'][generation])
+            ga.worst['individual'].append(worst_result[2]['individual'][generation])
+            ga.mean.append(np.mean([result[3][generation] for result in results]))
+
+    exe_time = time.time() - start_time
+    best, worst, mean = ga.history_results()
+    fitnesses = [ga.get_fitness(individual) for individual in population]
+    if incumbents is not None:
+        best_index = int(np.argmin(fitnesses))
+        incumbents.update(len(mean) - 1, fitnesses[best_index], lambda: ga.schedule(population[best_index]))
+    return population, fitnesses, best, worst, mean, exe_time
@@ -0,0 +1,47 @@
+import random
+from multiprocessing import Pool
+
+# GA used by the current worker process, set once by init_worker with the static
+# patient/capacity data (the population is never sent to the workers as a whole).
+# Only for ArrayGA: the Day/Machine individuals of GA cost more to send than to vary
+_ga = None
+
+
+def init_worker(ga):
+    global _ga
+    _ga = ga
+
+
+def vary(task):
+    # Each task carries its own seed, so results do not depend on the worker that runs it
+    seed, individuals = task
+    _ga.reseed(seed)
+    return _ga.vary(individuals)
+
+
+def create_pool(ga, workers):
+    # Copy of the GA without population to initialize the workers
+    static_ga = ga.__class__.__new__(ga.__class__)
+    static_ga.__dict__.update(ga.__dict__)
+    static_ga.population = []
+    return Pool(workers, initializer=init_worker, initargs=(static_ga,))
+
+
+def vary_population(ga, pool, parents, survivors):
+    # Seeds are drawn in the main process in a fixed order: same --seed, same result for any number of workers.
+    # A survivor is only mutated if the first draw of its task passes the mutation rate (as in GA.vary):
+    # the others are kept as they are instead of making the round trip
+    tasks = []
+    population = list(survivors)
+    mutated = []
+    for s, individual in enumerate(survivors):
+        seed = random.getrandbits(64)
+        if random.Random(seed).random() >= ga.mutation_rate:
+            tasks.append((seed, [individual]))
+            mutated.append(s)
+    tasks += [(random.getrandbits(64), parents[i:i+2]) for i in range(0, len(parents), 2)]
+
+    results = [individual for individuals in pool.map(vary, tasks) for individual in individuals]
+    for s, individual in zip(mutated, results):
+        population[s] = individual
+    return population + results[len(mutated):]
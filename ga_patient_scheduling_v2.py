@@ -1,17 +1,20 @@
 from typing import List, Dict
-import datetime
 import random
-import copy
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 import matplotlib.pyplot as plt
 import scienceplots
 import argparse
 #import pickle
 import dill
-import time
-from data_manipulation import create_data_model_2
+from data_manipulation import create_data_model
+import ga_engine
+from ga_engine import Patient, Machine, Day, Individual
+import ga_islands
+import incumbents
+import horizon
+import bounds
+from horizon import first_fit
 from pathlib import Path
 
 parser = argparse.ArgumentParser(description='Plot fitnesses of same encoding but different seeds.')
@@ -26,291 +29,312 @@ parser.add_argument('-g', dest='generations_num', action='store',
                     help='Number of generations', default='200', type=int)
 parser.add_argument('--seed', dest='seed', action='store',
                     help='Seed', default=23, type=int)
+ga_engine.add_arguments(parser)
+parser.add_argument('--workers', dest='workers', action='store',
+                    help='Number of worker processes for crossover, mutation and fitness with --encoding array (serial if not given)', default=None, type=int)
+parser.add_argument('--encoding', dest='encoding', action='store',
+                    help='Individual encoding (either objects or array)', default='objects', choices=['objects', 'array'])
+
+incumbents.add_arguments(parser, 'generations')
+horizon.add_arguments(parser)
 
 args = parser.parse_args()
+if args.workers is not None and args.encoding != 'array':
+    # A Day/Machine individual costs more to send to a worker and back than to vary it
+    parser.error("--workers requires --encoding array")
+if args.workers is not None and args.islands_num:
+    # Each island is already a process of its own
+    parser.error("--workers cannot be used with --islands")
+
+def last_used_day(occupation: np.ndarray):
+    used_days = np.flatnonzero((occupation > 0).any(axis=1))
+    return int(used_days[-1]) if len(used_days) > 0 else -1
+
+class CompactIndividual:
+    # start[k] is the start day of patient k, assignment[k, j] the machine index of its fraction j
+    # (-1 past the last fraction) and occupation[d, i] the minutes packed on machine i in day d.
+    # last_day and overflows are the fitness terms, kept up to date by ArrayGA.update_occupation
+    def __init__(self, start: np.ndarray, assignment: np.ndarray, occupation: np.ndarray, last_day, overflows, fitness = None):
+        self.start = start
+        self.assignment = assignment
+        self.occupation = occupation
+        self.last_day = last_day
+        self.overflows = overflows
+        self.fitness = fitness
+
+    def copy(self):
+        return CompactIndividual(self.start.copy(), self.assignment.copy(), self.occupation.copy(), self.last_day, self.overflows, self.fitness)
+
+
+class GA(ga_engine.GA):
+    def __init__(self, patients: List[Patient], *args, **kwargs):
+        # Random start days are drawn up to the length of the longest treatment
+        self.max_fractions = max(len(patient.get_fractions()) for patient in patients)
+        super().__init__(patients, *args, **kwargs)
+
+    def start_index(self, individual: Individual, patient: Patient):
+        return random.randint(0, min(
+            int(self.max_fractions),
+            max(len(individual)-len(patient.get_fractions())-1, 0)
+        ))
+
+    def mutation(self, individual: Individual):
+        #select randomly a patient and shift the starting treatment 
+        patient_to_shift = random.sample(self.patients, 1)[0]
+        shift_day = random.sample([-3, -2, -1, 1, 2, 3], 1)[0]
+        
+        d_start_ind, ind_mach = self.find_patient_start_day_and_machine(individual, patient_to_shift)
+
+        new_ind = d_start_ind + shift_day
 
-class Fraction:
-    def __init__(self, patient_id, id, size = 5):
-        self.patient_id = patient_id
-        self.id = id
-        self.size = size
-
-    def __eq__(self, other):
-        if not isinstance(other, Fraction):
-            return False
-        return self.patient_id == other.patient_id and self.id == other.id and self.size == other.size
-
-    def __hash__(self):
-        return hash(f"{self.patient_id}_{self.id}")
-    
-    def __repr__(self):
-        return f"{self.patient_id}_fraction_{self.id}_{self.size}"
-
-class Patient:
-    def __init__(self, id, fractions: List[int], machines: List[str]):
-        self.id = id
-        self.fractions = []
-        for i in range(len(fractions)):
-            self.fractions.append(Fraction(self.id, i, fractions[i]))
-        self.machines = machines
-
-    def get_fractions(self):
-        return self.fractions
-    
-    def get_machines(self):
-        return self.machines
-    
-    def __eq__(self, other):
-        if not isinstance(other, Patient):
-            return False
-        return self.id == other.id
-
-    def __hash__(self):
-        return hash(self.id)
-    
-    def __repr__(self):
-        return f"patient_{self.id}"
-    
-class Machine:
-    def __init__(self, id, capacity = 100):
-        self.id = id
-        self.patients = set()
-        self.start_patients = set()
-        self.capacity = capacity
-        self.occupation = 0
-
-    def get_patients(self):
-        return self.patients
-    
-    def get_start_patients(self):
-        return self.start_patients
-    
-    def add_patient(self, patient: Patient, fraction: Fraction):
-        self.patients.add(patient)
-        self.occupation += fraction.size
-    
-    def add_start_patient(self, patient: Patient):
-        self.start_patients.add(patient)
-
-    def remove_patient(self, patient: Patient, fraction: Fraction):
-        self.patients.remove(patient)
-        self.occupation -= fraction.size
-
-    def remove_start_patient(self, patient: Patient):
-        self.start_patients.remove(patient)
-
-    def getRemaininSpace(self):
-        return self.capacity - self.occupation
-
-class Day:
-    def __init__(self, id, date: datetime, machines : Dict[str, Machine]):
-        self.id = id
-        self.date = date
-        self.machines = machines
-
-    def find_patient_machine(self, patient: Patient):
-        machine = [key for key, value in self.machines.items() if patient in value.get_patients()]
-        if len(machine) != 1:
-            raise NotImplementedError
+        if new_ind < 0:
+            new_ind =  len(individual) - len(patient_to_shift.get_fractions())
+        if new_ind + len(patient_to_shift.get_fractions()) > len(individual):
+            new_ind = 0
         
-        return machine[0]
-
-class GA():
-    def __init__(self, patients: List[Patient], machines: List[Dict[str, int]], days, population_size, generations, mutation_rate, crossover_rate, tournament_size = 2, offspring_num = None):
-        self.patients = patients
-        self.population_size = population_size
-        self.generations = generations
-        self.mutation_rate = mutation_rate
-        self.crossover_rate = crossover_rate
-        self.tournament_size = tournament_size
-        if offspring_num is not None:
-            self.offspring_num = offspring_num
+        if self.mutation_operator == 'reassign':
+            self.remove_start_patient(patient_to_shift, individual, d_start_ind, ind_mach)
+            self.add_start_patient(patient_to_shift, individual, new_ind)
         else:
-            self.offspring_num = int(population_size/2)
-        self.population = self.create_population(patients, machines, days)
-
-    def add_start_patient(self, patient: Patient, individual: List[Day], index):
-        machine_chosen = random.sample(patient.get_machines(), 1)[0]
-        individual[index].machines[machine_chosen].add_start_patient(patient)
-
-        all_fractions = patient.get_fractions()
-        for i, fraction in enumerate(all_fractions):
-            try:
-                individual[i+index].machines[machine_chosen].add_patient(patient, fraction)
-            except IndexError:
-                print(len(individual), index, i)
-                raise IndexError
-            machine_chosen = random.sample(patient.get_machines(), 1)[0]
-
-    def remove_start_patient(self, patient: Patient, individual: List[Day], index_day, index_machine):
-        individual[index_day].machines[index_machine].remove_start_patient(patient)
-
-        all_fractions = patient.get_fractions()
-        for i, fraction in enumerate(all_fractions):
-            index_mach = individual[i+index_day].find_patient_machine(patient)
-            individual[i+index_day].machines[index_mach].remove_patient(patient, fraction)
+            self.shift_start_patient(patient_to_shift, individual, new_ind)
 
-    def create_population(self, patients: List[Patient], machines_list: List[Dict[str, int]], days):
-        # also try shuffling n times the items and applying first fit
+        # if sum([1 for day in individual[21:] if len(day.patients) > 0]) > 0:
+        #     raise NotImplementedError
+
+        return individual
+
+
+class ArrayGA(GA):
+    def __init__(self, patients: List[Patient], machines: List[Dict[str, int]], days, population_size, generations, mutation_rate, crossover_rate, tournament_size = 2, offspring_num = None, workers = None, selection_pressure = 1, history = 'full', checkpoint_interval = None, mutation_operator = 'reassign', greedy_fraction = 0):
         fractions_list = [len(patient.get_fractions()) for patient in patients]
-        total_fractions = sum(fractions_list)
+        horizon = min(sum(fractions_list), len(days), len(machines))
         max_fractions = max(fractions_list)
-        population = []
-        # all_days = [pd.to_datetime(i, unit='D', origin=pd.Timestamp('01-01-2020')).date() for i in range(total_fractions*2)]
-        # all_days = [d for d in all_days if d not in holidays.BE(years=2020) and d.weekday() < 5][:total_fractions]
-        all_days = days[:total_fractions]
+
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        self.days = days[:horizon]
+        self.machine_ids = list(machines[0].keys())
+        machine_index = {key: i for i, key in enumerate(self.machine_ids)}
+        self.capacity = np.array([[bin_d[key] for key in self.machine_ids] for bin_d in machines[:horizon]], dtype=float)
+
+        # Static patient data, one row per patient
+        self.n_fractions = np.array(fractions_list)
+        self.fraction_sizes = np.zeros((len(patients), max_fractions))
+        self.eligible = np.zeros((len(patients), max(len(patient.get_machines()) for patient in patients)), dtype=np.int8)
+        self.n_eligible = np.array([len(patient.get_machines()) for patient in patients])
+        for k, patient in enumerate(patients):
+            self.fraction_sizes[k, :fractions_list[k]] = [fraction.size for fraction in patient.get_fractions()]
+            self.eligible[k, :self.n_eligible[k]] = [machine_index[key] for key in patient.get_machines()]
+        self.fraction_offsets = np.arange(max_fractions)
+        self.fraction_mask = self.fraction_offsets[None, :] < self.n_fractions[:, None]
+
+        super().__init__(patients, machines, days, population_size, generations, mutation_rate, crossover_rate, tournament_size, offspring_num, workers, selection_pressure, history, checkpoint_interval, mutation_operator, greedy_fraction)
+
+    def reseed(self, seed):
+        super().reseed(seed)
+        self.rng = np.random.default_rng(seed)
+
+    def random_machines(self, k, size):
+        return self.eligible[k, self.rng.integers(self.n_eligible[k], size=size)]
+
+    def update_occupation(self, individual: CompactIndividual, days, machines, sizes):
+        # Add sizes (negative when removing) to the given cells, updating the fitness terms only there
+        occupation = individual.occupation
+        capacity = self.capacity[days, machines]
+        overflowing = int(np.count_nonzero(occupation[days, machines] > capacity))
+        occupation[days, machines] += sizes
+        individual.overflows += int(np.count_nonzero(occupation[days, machines] > capacity)) - overflowing
+
+        used_days = days[(occupation[days] > 0).any(axis=1)]
+        if len(used_days) > 0:
+            individual.last_day = max(individual.last_day, int(used_days.max()))
+        if individual.last_day >= 0 and not (occupation[individual.last_day] > 0).any():
+            individual.last_day = last_used_day(occupation[:individual.last_day])
+        individual.fitness = None
+
+    def add_start_patient(self, k, individual: CompactIndividual, index):
+        n = self.n_fractions[k]
+        machines = self.random_machines(k, n)
+        individual.start[k] = index
+        individual.assignment[k, :n] = machines
+        self.update_occupation(individual, index + self.fraction_offsets[:n], machines, self.fraction_sizes[k, :n])
+
+    def remove_start_patient(self, k, individual: CompactIndividual):
+        n = self.n_fractions[k]
+        index = individual.start[k]
+        self.update_occupation(individual, index + self.fraction_offsets[:n], individual.assignment[k, :n], -self.fraction_sizes[k, :n])
+
+    def shift_start_patient(self, k, individual: CompactIndividual, new_index):
+        # Same move as GA.shift_start_patient: the occupation changes only on the days at the two
+        # ends and on the days where the size of the packed fraction changes
+        n = self.n_fractions[k]
+        index = individual.start[k]
+        shift = new_index - index
+        offsets = self.fraction_offsets[:n]
+        sizes = self.fraction_sizes[k, :n]
+        machines = individual.assignment[k, :n]
+        new_machines = machines[(offsets + shift) % n] if abs(shift) < n else machines.copy()
+
+        # Old days: fraction j - shift of the new schedule is packed there (if any), on the same machine
+        moved = offsets - shift
+        overlap = (moved >= 0) & (moved < n)
+        old_sizes = -sizes
+        old_sizes[overlap] += sizes[moved[overlap]]
+        # New days not in the old schedule
+        new_only = (offsets + shift < 0) | (offsets + shift >= n)
+
+        days = np.concatenate([index + offsets, new_index + offsets[new_only]])
+        cell_machines = np.concatenate([machines, new_machines[new_only]])
+        cell_sizes = np.concatenate([old_sizes, sizes[new_only]])
+        changed = cell_sizes != 0
+        self.update_occupation(individual, days[changed], cell_machines[changed], cell_sizes[changed])
+        individual.start[k] = new_index
+        individual.assignment[k, :n] = new_machines
+
+    def first_fit_individual(self, order, last_start):
+        # Patients placed in the given order by first_fit, or at a random start with random
+        # machines (as in a random individual) if they do not fit anywhere
+        start = np.zeros(len(self.patients), dtype=int)
+        assignment = np.full(self.fraction_sizes.shape, -1)
+        occupation = np.zeros_like(self.capacity)
+        for k in order:
+            n = self.n_fractions[k]
+            sizes = self.fraction_sizes[k, :n]
+            placement = first_fit(self.capacity - occupation, self.eligible[k, :self.n_eligible[k]], sizes)
+            if placement is None:
+                placement = int(self.rng.integers(0, last_start[k] + 1)), self.random_machines(k, n)
+            start[k], assignment[k, :n] = placement
+            occupation[start[k] + self.fraction_offsets[:n], assignment[k, :n]] += sizes
+        overflows = int(np.count_nonzero(occupation > self.capacity))
+        return CompactIndividual(start, assignment, occupation, last_used_day(occupation), overflows)
+
+    def create_population(self, patients: List[Patient], machines_list: List[Dict[str, int]], days):
+        horizon = len(self.capacity)
+        # Day 0 at least for the treatments as long as a tight horizon (see horizon.tighten)
+        last_start = np.minimum(self.fraction_sizes.shape[1], np.maximum(horizon - self.n_fractions - 1, 0))
         population = []
 
-        for _ in range(self.population_size):
-            machines = [{key: Machine(key, value) for key, value in machines.items()} for machines in machines_list]
-            individual = [Day(i, day, machines[i]) for i, day in enumerate(all_days)]
-            for patient in patients:
-                index = random.randint(0, min(
-                    int(max_fractions), 
-                    len(individual)-len(patient.get_fractions())-1
-                ))
-                self.add_start_patient(patient, individual, index)
-            population.append(individual)
+        # The first greedy_fraction of the population is built by first fit: longest treatments
+        # first for the first individual, the patients shuffled for the others
+        greedy_num = round(self.greedy_fraction * self.population_size)
+        longest_first = np.argsort(-self.fraction_sizes.sum(axis=1), kind='stable')
+        for p in range(greedy_num):
+            population.append(self.first_fit_individual(longest_first if p == 0 else self.rng.permutation(len(self.patients)), last_start))
+
+        for _ in range(self.population_size - greedy_num):
+            start = self.rng.integers(0, last_start + 1)
+            choices = (self.rng.random(self.fraction_sizes.shape) * self.n_eligible[:, None]).astype(int)
+            assignment = np.take_along_axis(self.eligible, choices, axis=1)
+            assignment[~self.fraction_mask] = -1
+
+            occupation = np.zeros_like(self.capacity)
+            day_index = start[:, None] + self.fraction_offsets[None, :]
+            np.add.at(occupation, (day_index[self.fraction_mask], assignment[self.fraction_mask]), self.fraction_sizes[self.fraction_mask])
+            overflows = int(np.count_nonzero(occupation > self.capacity))
+            population.append(CompactIndividual(start, assignment, occupation, last_used_day(occupation), overflows))
 
         return population
-    
-    def find_patient_start_day_and_machine(self, individual, patient: Patient):
-        indexes = [(ind_day, ind_mach) for ind_day, day in enumerate(individual) for ind_mach, mach in day.machines.items() if patient in mach.start_patients]
-        if len(indexes) != 1:
-            raise NotImplementedError
-        return indexes[0]
 
-    def crossover(self, parent1: List[Day], parent2: List[Day]):
-        child1 = copy.deepcopy(parent1)
-        child2 = copy.deepcopy(parent2)
+    def crossover(self, parent1: CompactIndividual, parent2: CompactIndividual):
+        child1 = parent1.copy()
+        child2 = parent2.copy()
 
         if random.random() > self.crossover_rate:
-            cross_patients = random.sample(self.patients, random.randint(1, min(3, len(self.patients))))
+            n_patients = len(self.patients)
+            cross_patients = random.sample(range(n_patients), random.randint(1, min(3, n_patients)))
 
-            for cross_p in cross_patients:
-                d_start_1_ind, ind_mach_1 = self.find_patient_start_day_and_machine(child1, cross_p)
-                d_start_2_ind, ind_mach_2 = self.find_patient_start_day_and_machine(child2, cross_p)
+            for k in cross_patients:
+                d_start_1_ind = child1.start[k]
+                d_start_2_ind = child2.start[k]
 
-                self.remove_start_patient(cross_p, child1, d_start_1_ind, ind_mach_1)
-                self.add_start_patient(cross_p, child1, d_start_2_ind)
+                self.remove_start_patient(k, child1)
+                self.add_start_patient(k, child1, d_start_2_ind)
 
-                self.remove_start_patient(cross_p, child2, d_start_2_ind, ind_mach_2)
-                self.add_start_patient(cross_p, child2, d_start_1_ind)
+                self.remove_start_patient(k, child2)
+                self.add_start_patient(k, child2, d_start_1_ind)
 
-            # if sum([1 for day in child1[21:] if len(day.patients) > 0]) > 0 or sum([1 for day in child2[21:] if len(day.patients) > 0]) > 0:
-            #     raise NotImplementedError
-            
         return child1, child2
 
-    def mutation(self, individual: List[Day]):
-        #select randomly a patient and shift the starting treatment 
-        patient_to_shift = random.sample(self.patients, 1)[0]
+    def mutation(self, individual: CompactIndividual):
+        k = random.randrange(len(self.patients))
         shift_day = random.sample([-3, -2, -1, 1, 2, 3], 1)[0]
-        
-        d_start_ind, ind_mach = self.find_patient_start_day_and_machine(individual, patient_to_shift)
+        horizon = len(individual.occupation)
+        n = self.n_fractions[k]
 
-        new_ind = d_start_ind + shift_day
+        new_ind = individual.start[k] + shift_day
 
         if new_ind < 0:
-            new_ind =  len(individual) - len(patient_to_shift.get_fractions())
-        if new_ind + len(patient_to_shift.get_fractions()) > len(individual):
+            new_ind = horizon - n
+        if new_ind + n > horizon:
             new_ind = 0
-        
-        self.remove_start_patient(patient_to_shift, individual, d_start_ind, ind_mach)
-        self.add_start_patient(patient_to_shift, individual, new_ind)
 
-        # if sum([1 for day in individual[21:] if len(day.patients) > 0]) > 0:
-        #     raise NotImplementedError
+        if self.mutation_operator == 'reassign':
+            self.remove_start_patient(k, individual)
+            self.add_start_patient(k, individual, new_ind)
+        else:
+            self.shift_start_patient(k, individual, new_ind)
 
         return individual
-    
-    def get_fitness(self, individual: List[Day]):
-        f = 0
-        days_len = len(individual)
-        for i in range(1, days_len+1):
-            if(sum([1 for machine in individual[-i].machines.values() if machine.occupation > 0]) != 0):
-                f += days_len-i+1
-                break
-        for day in individual:
-            f += 50 * sum([1 for machine in day.machines.values() if machine.getRemaininSpace() < 0])
-
-        return f
-
-    def tournament_selection(self):
-        k = self.tournament_size
-        n = self.offspring_num
-
-        if k < 1 or k > len(self.population):
-            raise NotImplementedError
-        parents = []
-        for i in range(n):
-            parents.append(sorted(random.sample(self.population, k), key= lambda a: self.get_fitness(a), reverse=False)[0])
-        
-        return parents
-
-
-    def run(self):
-        start_time = time.time()
-
-        sorted_pop = sorted(self.population, key = lambda a: self.get_fitness(a), reverse=False)
-        worst = {
-            'fitness':[self.get_fitness(sorted_pop[-1])],
-            'individual':[sorted_pop[-1]]
-        }
-        mean = [np.mean([self.get_fitness(individual) for individual in sorted_pop])]
-        best = {
-            'fitness':[self.get_fitness(sorted_pop[0])],
-            'individual':[sorted_pop[0]]
-        }
-
-        for _ in tqdm(range(self.generations)):
-            # if sum([sum([1 for day in individual[21:] if len(day.patients) > 0]) for individual in self.population]) > 0:
-            #     raise NotImplementedError
-            # TODO: use crossover rate
-            parents = self.tournament_selection()
-            offspring = []
-            for i in range(0, len(parents), 2):
-                child1, child2 = self.crossover(parents[i], parents[i+1])
-                offspring.append(child1)
-                offspring.append(child2)
-            sorted_pop = sorted(self.population, key = lambda a: self.get_fitness(a), reverse=False)
-            self.population = sorted_pop[:len(sorted_pop)-self.offspring_num] + offspring
-            for i in range(len(self.population)):
-                if random.random() >= self.mutation_rate:
-                    self.population[i] = self.mutation(self.population[i])
-            
-            sorted_pop = sorted(self.population, key = lambda a: self.get_fitness(a), reverse=False)
-            worst['fitness'].append(self.get_fitness(sorted_pop[-1]))
-            worst['individual'].append(sorted_pop[-1])
-            best['fitness'].append(self.get_fitness(sorted_pop[0]))
-            best['individual'].append(sorted_pop[0])
-            mean.append(np.mean([self.get_fitness(individual) for individual in sorted_pop]))
-
-        exe_time = time.time() - start_time
-        return self.population, [self.get_fitness(individual) for individual in self.population], best, worst, mean, exe_time
+
+    def schedule(self, individual: CompactIndividual):
+        return {patient.id: [str(self.days[individual.start[k]]), [self.machine_ids[i] for i in individual.assignment[k, :self.n_fractions[k]]]]
+                for k, patient in enumerate(self.patients)}
+
+    def snapshot(self, individual: CompactIndividual):
+        return individual.copy()
+
+    def export(self, individual: CompactIndividual):
+        # Build the Day/Machine view of the schedule, as produced by GA
+        machines = [{key: Machine(key, capacity) for key, capacity in zip(self.machine_ids, row)} for row in self.capacity]
+        days = [Day(i, day, machines[i]) for i, day in enumerate(self.days)]
+        for k, patient in enumerate(self.patients):
+            index = individual.start[k]
+            days[index].machines[self.machine_ids[individual.assignment[k, 0]]].add_start_patient(patient)
+            for j, fraction in enumerate(patient.get_fractions()):
+                days[index + j].machines[self.machine_ids[individual.assignment[k, j]]].add_patient(patient, fraction)
+
+        return days
 
 
 if __name__ == "__main__":
     random.seed(args.seed)
 
-    data = create_data_model_2(args)
+    data = create_data_model(args)
+    if args.tight_horizon:
+        data = horizon.tighten(data)
 
     patients = [Patient(id, list(patient["fractions"].values()), patient["machines"]) for id, patient in data["patients"].items()]
-    alg = GA(patients, list(data["bin_days"].values()), list(data["day_to_actual_days"].values()), args.pop_size, args.generations_num, 1, 0.8)
+    ga_class = ArrayGA if args.encoding == 'array' else GA
+    create_ga = lambda: ga_class(patients, list(data["bin_days"].values()), list(data["day_to_actual_days"].values()), args.pop_size, args.generations_num, 1, 0.8, tournament_size=args.tournament_size, workers=args.workers, selection_pressure=args.selection_pressure, history=args.history, checkpoint_interval=args.checkpoint_interval, mutation_operator=args.mutation_operator, greedy_fraction=args.greedy_fraction)
+    lower_bound = bounds.fitness_bound(data) if args.bound else None
+    run_incumbents = incumbents.Incumbents(args.incumbent_log, args.time_budget, args.target, args.stall, 'GA', lower_bound)
+    alg = create_ga()
+    if args.benchmark_mutation:
+        ga_engine.benchmark_mutation(alg, args.benchmark_mutation)
+        exit()
     print([alg.get_fitness(individual) for individual in alg.population])
-    population, fitnesses, best, worst, mean, exe_time = alg.run()
+    if args.islands_num:
+        algs = [alg] + [create_ga() for _ in range(args.islands_num - 1)]
+        population, fitnesses, best, worst, mean, exe_time = ga_islands.run(algs, args.migration_interval, args.topology, args.migrants_num, run_incumbents)
+    else:
+        population, fitnesses, best, worst, mean, exe_time = alg.run(run_incumbents)
     print(fitnesses)
+    if lower_bound is not None:
+        print(f"Best fitness {min(fitnesses)}, lower bound {lower_bound}, gap {bounds.gap(min(fitnesses), lower_bound):.2%}")
 
     sorted_pop = sorted(population, key = lambda a: alg.get_fitness(a), reverse=False)
     fileName = f'{args.save_file}_{args.seed}.pkl'
     output_file = Path(fileName)
     output_file.parent.mkdir(exist_ok=True, parents=True)
+    save_dict = {'best': best, 'worst': worst, 'mean': mean, 'time': exe_time, 'best_individual': alg.export(sorted_pop[0])}
+    if args.history == 'scalars':
+        save_dict['history'] = alg.scalars
+        save_dict['checkpoints'] = {generation: alg.export(individual) for generation, individual in alg.checkpoints.items()}
     with open(fileName, 'wb') as handle:
-        dill.dump({'best': best, 'worst': worst, 'mean': mean, 'time': exe_time, 'best_individual': sorted_pop[0]}, handle, protocol=dill.HIGHEST_PROTOCOL)
+        dill.dump(save_dict, handle, protocol=dill.HIGHEST_PROTOCOL)
     # for day in sorted_pop[0]:
     #     print(day.date)
     #     for machine in day.machines.values():
     #         print(f"Machine {machine.id} with remaining space {machine.getRemaininSpace()}:")
     #         print(machine.get_patients())
 
-    #save_plot(args, best, worst, mean)
\ No newline at end of file
+    #save_plot(args, best, worst, mean)
@@ -0,0 +1,81 @@
+import numpy as np
+import bounds
+
+
+def add_arguments(parser):
+    parser.add_argument('--tight-horizon', dest='tight_horizon', action='store_true',
+                        help='Trim the planning horizon to the last day of a greedy (first fit) schedule instead of the total number of fractions')
+
+
+def first_fit(residual: np.ndarray, eligible, sizes: np.ndarray, earliest=0):
+    # Earliest start day (not before earliest) such that fraction j fits on day start + j in one of
+    # the eligible machines (columns of residual, the space left on each day and machine), the
+    # machine of each fraction chosen by best fit (least space left). None if the treatment does
+    # not fit anywhere
+    n = len(sizes)
+    starts = len(residual) - n + 1
+    if starts <= earliest:
+        return None
+    space = residual[:, eligible]
+    # Usually only the first fraction has a different size: compare each distinct size once
+    unique_sizes, size_index = np.unique(sizes, return_inverse=True)
+    fits = space[None, :, :] >= unique_sizes[:, None, None]
+    day_fits = fits.any(axis=2)[size_index]
+    offsets = np.arange(n)
+    valid = np.flatnonzero(day_fits[offsets[None, :], np.arange(earliest, starts)[:, None] + offsets[None, :]].all(axis=1))
+    if len(valid) == 0:
+        return None
+    start = earliest + int(valid[0])
+    days = start + offsets
+    left = np.where(fits[size_index, days], space[days] - sizes[:, None], np.inf)
+    return start, np.asarray(eligible)[left.argmin(axis=1)]
+
+
+def capacity_matrix(data):
+    # Space left on each day (rows) and machine (columns, in the order of the machines of day 0)
+    machines = list(data["bin_days"][0])
+    capacity = np.array([[bin_d[i] for i in machines] for bin_d in data["bin_days"].values()], dtype=float)
+    return machines, capacity
+
+
+def greedy_schedule(data):
+    # First fit of the patients by arrival day, longest treatments first: {k: (start day, machine
+    # of each fraction)}, None if a patient does not fit in the horizon
+    machines, residual = capacity_matrix(data)
+    machine_index = {i: m for m, i in enumerate(machines)}
+    order = sorted(data["patients"], key=lambda k: (data["patients"][k]["arrival_day"], -sum(data["patients"][k]["fractions"].values())))
+    schedule = {}
+    for k in order:
+        item_k = data["patients"][k]
+        sizes = np.array(list(item_k["fractions"].values()), dtype=float)
+        placement = first_fit(residual, [machine_index[i] for i in item_k["machines"]], sizes, item_k["arrival_day"])
+        if placement is None:
+            return None
+        start, assigned = placement
+        residual[start + np.arange(len(sizes)), assigned] -= sizes
+        schedule[k] = (start, [machines[m] for m in assigned])
+    return schedule
+
+
+def upper_bound(data):
+    # Days needed by the greedy schedule (the whole horizon if it does not find one)
+    schedule = greedy_schedule(data)
+    if schedule is None:
+        return len(data["bin_days"])
+    return max(start + len(data["patients"][k]["fractions"]) for k, (start, machines) in schedule.items())
+
+
+def trim(data, horizon):
+    # Data with the first horizon days only
+    trimmed = dict(data)
+    trimmed["bin_days"] = {d: data["bin_days"][d] for d in range(horizon)}
+    if "columnar" in data:
+        trimmed["columnar"] = dict(data["columnar"], capacity=data["columnar"]["capacity"][:horizon], used=data["columnar"]["used"][:horizon])
+    return trimmed
+
+
+def tighten(data):
+    # Data trimmed to the upper bound on the days needed, both bounds are printed
+    lower, upper = bounds.makespan_bound(data), upper_bound(data)
+    print(f"Horizon: {upper} days (greedy schedule, was {len(data['bin_days'])}), at least {lower} days needed")
+    return trim(data, upper)
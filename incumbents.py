@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+import bounds
+
+
+def add_arguments(parser, stall_unit):
+    # Options shared by the GA and the exact scripts (stall_unit is 'generations' or 'seconds')
+    parser.add_argument('--incumbent-log', dest='incumbent_log', action='store',
+                        help='File where every improving solution is appended as a JSON line (time, objective and schedule)', default=None)
+    parser.add_argument('--time-budget', dest='time_budget', action='store',
+                        help='Wall-clock budget in seconds, the best solution found so far is kept when it runs out', default=None, type=float)
+    parser.add_argument('--target', dest='target', action='store',
+                        help='Stop as soon as a solution with at most this objective is found', default=None, type=float)
+    parser.add_argument('--stall', dest='stall', action='store',
+                        help=f'Stop after this many {stall_unit} without improvement', default=None, type=float)
+    parser.add_argument('--bound', dest='bound', action='store_true',
+                        help='Compute a lower bound on the objective, report the gap of the best solution and stop as soon as it reaches the bound')
+
+
+def schedule_from_items(data, items):
+    # Compact schedule {patient: [start date, machine of each fraction]} of the items (j, k, i, d)
+    # packed by an exact model, same format as GA.schedule
+    fractions = {}
+    for j, k, i, d in items:
+        fractions.setdefault(k, {})[j] = (d, i)
+    schedule = {}
+    for k, fractions_k in fractions.items():
+        start_day = fractions_k[min(fractions_k)][0]
+        schedule[k] = [str(data["day_to_actual_days"][start_day]), [fractions_k[j][1] for j in sorted(fractions_k)]]
+    return schedule
+
+
+class Incumbents:
+    # Best objective of a run, with the improving solutions appended to log_file as they are found
+    # and the early stop rules: time_budget seconds since the start, an objective of at most
+    # target, or stall steps (generations or seconds, the unit of the step given to update)
+    # without improvement. With a lower_bound (see bounds.py) the run also stops when the best
+    # objective reaches it, as no better solution exists
+    def __init__(self, log_file=None, time_budget=None, target=None, stall=None, engine='', lower_bound=None):
+        self.log_file = log_file
+        self.time_budget = time_budget
+        self.target = target
+        self.stall = stall
+        self.engine = engine
+        self.lower_bound = lower_bound
+        self.start_time = time.time()
+        self.best = None
+        self.best_step = 0
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def remaining(self):
+        return None if self.time_budget is None else max(self.time_budget - self.elapsed(), 0)
+
+    def gap(self, bound=None):
+        # Gap of the best objective from the lower bound, or from bound if it is higher (the
+        # bound proved by the solver); None without a best objective or a bound
+        bound = max((b for b in (self.lower_bound, bound) if b is not None), default=None)
+        if self.best is None or bound is None:
+            return None
+        return bounds.gap(self.best, bound)
+
+    def update(self, step, objective, schedule):
+        # schedule is called (and the solution logged) only if objective improves the best one
+        if self.best is not None and objective >= self.best:
+            return False
+        self.best = objective
+        self.best_step = step
+        if self.log_file is not None:
+            entry = {'engine': self.engine, 'time': self.elapsed(), 'objective': float(objective),
+                     'gap': self.gap(), 'schedule': {str(k): value for k, value in schedule().items()}}
+            with open(self.log_file, 'a') as handle:
+                handle.write(json.dumps(entry) + '\n')
+        return True
+
+    def done(self, step):
+        if self.time_budget is not None and self.elapsed() >= self.time_budget:
+            return True
+        if self.target is not None and self.best is not None and self.best <= self.target:
+            return True
+        if self.lower_bound is not None and self.best is not None and self.best <= self.lower_bound:
+            return True
+        return self.stall is not None and self.best is not None and step - self.best_step >= self.stall
+
+
+@contextmanager
+def watchdog(run_incumbents, stop, interval=0.1):
+    # Calls stop() from another thread as soon as the early stop rules of run_incumbents apply,
+    # for the rules (time budget, stall) that can trigger between two solutions
+    finished = threading.Event()
+
+    def watch():
+        while not finished.wait(interval):
+            if run_incumbents.done(run_incumbents.elapsed()):
+                stop()
+                return
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        finished.set()
+        thread.join()
@@ -0,0 +1,44 @@
+import hashlib
+import os
+from pathlib import Path
+import dill
+
+# To be increased when the content of the model cache changes
+CACHE_VERSION = 1
+
+
+def add_arguments(parser):
+    parser.add_argument('--model-cache', dest='model_cache', action='store',
+                        help='Folder where the built model is saved, keyed by instance and formulation: the runs on the same instance load it instead of building it again', default=None)
+
+
+def get_cache_file(cache_dir, data, engine, formulation):
+    # The key depends on the data the model is built from (patients and residual capacities, so a
+    # rolling horizon window gets its own entry), on the engine and on the formulation, but not on
+    # the solver parameters, which are set after the model is loaded
+    key = hashlib.sha256(f"{CACHE_VERSION}_{engine}_{formulation}".encode())
+    key.update(repr((data["patients"], data["bin_days"])).encode())
+    return Path(cache_dir) / f"{key.hexdigest()}.model"
+
+
+def save(cache_file, proto, x, y, z, index):
+    # proto is the model (CpModelProto or MPModelProto) and index(var) the index of a variable in it
+    entry = {'proto': proto.SerializeToString(),
+             'x': {key: index(var) for key, var in x.items()},
+             'y': {key: index(var) for key, var in y.items()},
+             'z': {key: index(var) for key, var in z.items()}}
+    cache_file.parent.mkdir(exist_ok=True, parents=True)
+    # Atomic write: runs in parallel can create the same entry
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, 'wb') as handle:
+        dill.dump(entry, handle, protocol=dill.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+
+def load(cache_file, load_proto):
+    # load_proto(serialized) loads the model into the solver and returns the list of its variables,
+    # x, y and z are rebuilt from it (the same variable object for the keys sharing a variable)
+    with open(cache_file, 'rb') as handle:
+        entry = dill.load(handle)
+    variables = load_proto(entry['proto'])
+    return tuple({key: variables[var] for key, var in entry[name].items()} for name in ('x', 'y', 'z'))
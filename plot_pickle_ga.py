@@ -98,14 +98,15 @@ def plot_results():
                     #print(f"{ga} 200 100 inst_{ind} {seed}", ga_data['time'])
 
 
-            ga_data_seeds[ind]['100_200']['best'] = [np.mean([bests[gen] for bests in ga_data_seeds[ind]['100_200']['best']]) for gen in range(200)]
-            ga_data_seeds[ind]['100_200']['mean'] = [np.mean([bests[gen] for bests in ga_data_seeds[ind]['100_200']['mean']]) for gen in range(200)]
-            ga_data_seeds[ind]['100_200']['worst'] = [np.mean([bests[gen] for bests in ga_data_seeds[ind]['100_200']['worst']]) for gen in range(200)]
+            # Runs stopped early (--target, --stall, --bound) are extended with their last value
+            ga_data_seeds[ind]['100_200']['best'] = [np.mean([bests[min(gen, len(bests) - 1)] for bests in ga_data_seeds[ind]['100_200']['best']]) for gen in range(200)]
+            ga_data_seeds[ind]['100_200']['mean'] = [np.mean([bests[min(gen, len(bests) - 1)] for bests in ga_data_seeds[ind]['100_200']['mean']]) for gen in range(200)]
+            ga_data_seeds[ind]['100_200']['worst'] = [np.mean([bests[min(gen, len(bests) - 1)] for bests in ga_data_seeds[ind]['100_200']['worst']]) for gen in range(200)]
             
 
-            ga_data_seeds[ind]['200_100']['best'] = [np.mean([bests[gen] for bests in ga_data_seeds[ind]['200_100']['best']]) for gen in range(100)]
-            ga_data_seeds[ind]['200_100']['mean'] = [np.mean([bests[gen] for bests in ga_data_seeds[ind]['200_100']['mean']]) for gen in range(100)]
-            ga_data_seeds[ind]['200_100']['worst'] = [np.mean([bests[gen] for bests in ga_data_seeds[ind]['200_100']['worst']]) for gen in range(100)]
+            ga_data_seeds[ind]['200_100']['best'] = [np.mean([bests[min(gen, len(bests) - 1)] for bests in ga_data_seeds[ind]['200_100']['best']]) for gen in range(100)]
+            ga_data_seeds[ind]['200_100']['mean'] = [np.mean([bests[min(gen, len(bests) - 1)] for bests in ga_data_seeds[ind]['200_100']['mean']]) for gen in range(100)]
+            ga_data_seeds[ind]['200_100']['worst'] = [np.mean([bests[min(gen, len(bests) - 1)] for bests in ga_data_seeds[ind]['200_100']['worst']]) for gen in range(100)]
             save_plot(f"solutions/{ga}/100_200_nstance_{ind}", ga_data_seeds[ind]['100_200']['best'], ga_data_seeds[ind]['100_200']['worst'], ga_data_seeds[ind]['100_200']['mean'])
             save_plot(f"solutions/{ga}/200_100_nstance_{ind}", ga_data_seeds[ind]['200_100']['best'], ga_data_seeds[ind]['200_100']['worst'], ga_data_seeds[ind]['200_100']['mean'])
        
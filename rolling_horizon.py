@@ -0,0 +1,54 @@
+def window_data(data, patients, bin_days, horizon):
+    # Data of a window: its patients and the residual capacity of the first horizon days
+    sub_data = dict(data)
+    sub_data["patients"] = patients
+    sub_data["bin_days"] = {d: dict(bin_days[d]) for d in range(horizon)}
+    return sub_data
+
+
+def solve(data, solve_window, window, overlap=0, out_of_time=lambda: False):
+    # Rolling horizon: the patients arriving in [start, start + window + overlap) are scheduled
+    # together, the ones arriving in [start, start + window) are committed and their usage removed
+    # from the capacities before moving on to the next window.
+    # solve_window(sub_data, used_days) must return (status_str, bin_items, used_bins, wall_time)
+    # with status_str None if no solution was found; used_days are the days already used by
+    # the committed patients, which do not add to the objective of the window. Once out_of_time()
+    # a window without solution is not tried again with a longer horizon.
+    horizon = len(data["bin_days"])
+    bin_days = {d: dict(bin_d) for d, bin_d in data["bin_days"].items()}
+    remaining = dict(data["patients"])
+    bin_items = {}
+    used_days = set()
+    wall_time = 0
+
+    while remaining:
+        start = min(item_k["arrival_day"] for item_k in remaining.values())
+        patients = {k: item_k for k, item_k in remaining.items() if item_k["arrival_day"] < start + window + overlap}
+        committed = [k for k, item_k in patients.items() if item_k["arrival_day"] < start + window]
+
+        # Days needed to treat every patient of the window right after its arrival, plus some
+        # slack for the ones to be delayed: doubled until the window has a solution
+        slack = window + overlap
+        while True:
+            window_horizon = min(max(item_k["arrival_day"] + len(item_k["fractions"]) for item_k in patients.values()) + slack, horizon)
+            print(f"Window of arrival days [{start}, {start + window + overlap}): {len(patients)} patients, {window_horizon} days")
+            status_str, window_items, window_bins, window_time = solve_window(window_data(data, patients, bin_days, window_horizon), used_days)
+            wall_time += window_time
+            if status_str is not None or window_horizon == horizon or out_of_time():
+                break
+            slack *= 2
+
+        if status_str is None:
+            return None, {}, set(), wall_time
+
+        for (i, d), items in window_items.items():
+            for j, k in items:
+                if k in committed:
+                    bin_items.setdefault((i, d), []).append((j, k))
+                    bin_days[d][i] -= data["patients"][k]["fractions"][j]
+                    used_days.add(d)
+        for k in committed:
+            del remaining[k]
+
+    # The schedule is built window by window, it is feasible but not optimal in general
+    return "feasible", bin_items, set(bin_items), wall_time
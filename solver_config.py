@@ -0,0 +1,106 @@
+import os
+import time
+from google.protobuf import text_format
+from ortools.linear_solver import pywraplp
+from ortools.sat.python import cp_model
+
+
+def add_arguments(parser, time_limit=None):
+    # Solver options shared by the exact scripts (time_limit is the script default, in seconds)
+    parser.add_argument('--workers', dest='workers', action='store',
+                        help='Number of search workers (number of available cores if not given)', default=None, type=int)
+    parser.add_argument('--time-limit', dest='time_limit', action='store',
+                        help='Time limit of the solver in seconds', default=time_limit, type=float)
+    parser.add_argument('--gap', dest='gap', action='store',
+                        help='Relative gap between objective and bound at which the search stops', default=None, type=float)
+    parser.add_argument('--no-presolve', dest='presolve', action='store_false',
+                        help='Disable presolve')
+    parser.add_argument('--no-lns', dest='lns', action='store_false',
+                        help='Disable large neighborhood search (CP-SAT and SAT backend only)')
+    parser.add_argument('--params', dest='params_file', action='store',
+                        help='File of solver specific parameters, applied after the other options (SatParameters in text format for CP-SAT and SAT, the backend format otherwise)', default=None)
+    parser.add_argument('--log', dest='log', action='store_true',
+                        help='Print the search log of the solver')
+
+
+def default_workers():
+    # Cores this process can run on (fewer than os.cpu_count() under taskset or in containers)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def read_params(params_file):
+    with open(params_file) as handle:
+        return handle.read()
+
+
+def time_limit(args, time_budget=None):
+    # Time limit of the solver: the one of the options or what is left of the budget, if shorter
+    limits = [limit for limit in (args.time_limit, time_budget) if limit is not None]
+    return min(limits) if limits else None
+
+
+def configure_cp(solver, args, time_budget=None):
+    solver.parameters.num_workers = args.workers if args.workers is not None else default_workers()
+    if time_limit(args, time_budget) is not None:
+        solver.parameters.max_time_in_seconds = time_limit(args, time_budget)
+    if args.gap is not None:
+        solver.parameters.relative_gap_limit = args.gap
+    solver.parameters.cp_model_presolve = args.presolve
+    solver.parameters.use_lns = args.lns
+    solver.parameters.log_search_progress = args.log
+    if args.params_file is not None:
+        text_format.Merge(read_params(args.params_file), solver.parameters)
+
+
+def configure_ilp(solver, args, time_budget=None, specific_params=()):
+    # Returns the MPSolverParameters to pass to solver.Solve
+    solver.SetNumThreads(args.workers if args.workers is not None else default_workers())
+    if time_limit(args, time_budget) is not None:
+        # At least 1 ms: for pywraplp a time limit of 0 means no limit (an exhausted budget)
+        solver.SetTimeLimit(max(int(time_limit(args, time_budget) * 1000), 1))
+    if args.log:
+        solver.EnableOutput()
+    specific_params = list(specific_params)
+    if args.backend_solver == 'SAT':
+        specific_params.append(f"use_lns: {str(args.lns).lower()}")
+    if args.params_file is not None:
+        specific_params.append(read_params(args.params_file))
+    if specific_params:
+        solver.SetSolverSpecificParametersAsString("\n".join(specific_params))
+
+    params = pywraplp.MPSolverParameters()
+    if args.gap is not None:
+        params.SetDoubleParam(pywraplp.MPSolverParameters.RELATIVE_MIP_GAP, args.gap)
+    params.SetIntegerParam(pywraplp.MPSolverParameters.PRESOLVE,
+                           pywraplp.MPSolverParameters.PRESOLVE_ON if args.presolve else pywraplp.MPSolverParameters.PRESOLVE_OFF)
+    return params
+
+
+class IncumbentCallback(cp_model.CpSolverSolutionCallback):
+    # Prints every improving solution found by CP-SAT with the time since the start of the search.
+    # With run_incumbents (incumbents.Incumbents) the solutions are also streamed to its log,
+    # schedule(value) giving the schedule of the current solution, the gap from its lower bound is
+    # printed and the search is stopped by its early stop rules
+    def __init__(self, run_incumbents=None, schedule=None):
+        super().__init__()
+        self.start_time = time.time()
+        self.incumbents = []
+        self.run_incumbents = run_incumbents
+        self.schedule = schedule
+
+    def on_solution_callback(self):
+        incumbent = (time.time() - self.start_time, self.ObjectiveValue(), self.BestObjectiveBound())
+        self.incumbents.append(incumbent)
+        message = f"Incumbent at {incumbent[0]:.3f} s: objective {incumbent[1]:g}, bound {incumbent[2]:g}"
+        if self.run_incumbents is None:
+            print(message)
+            return
+        elapsed = self.run_incumbents.elapsed()
+        self.run_incumbents.update(elapsed, incumbent[1], lambda: self.schedule(self.Value))
+        gap = self.run_incumbents.gap(incumbent[2])
+        print(message if gap is None else f"{message}, gap {gap:.2%}")
+        if self.run_incumbents.done(elapsed):
+            self.StopSearch()